@@ -1,16 +1,125 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, json, jsonify, request, stream_with_context
 from datetime import date, timedelta
-from models import db, Member, Book, Loan
+import csv
+import io
+import os
+import click
+from models import db, Member, Book, Loan, init_schema, overdue_loans_query, rebuild_active_loans
 from flask import send_from_directory
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///library.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('LIBRARY_DATABASE_URI', 'sqlite:///library.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+BULK_BATCH_SIZE = 5000
+
 with app.app_context():
-    db.create_all()
+    init_schema()
+
+
+def list_response(model, serialize):
+    """Lista rekordów posortowana po id.
+
+    Bez parametrów zwraca całą tabelę jak dotychczas. ?after=<id>&limit=<n> zwraca jedną stronę (keyset po id),
+    a id ostatniego rekordu pełnej strony trafia do nagłówka X-Next-After. ?format=ndjson strumieniuje wiersze
+    partiami po STREAM_BATCH_SIZE, więc zużycie pamięci nie zależy od rozmiaru tabeli.
+    """
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    if after is not None and limit is None:
+        limit = DEFAULT_PAGE_SIZE
+
+    query = db.select(model).order_by(model.id)
+    if after is not None:
+        query = query.where(model.id > after)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = query.limit(limit)
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            rows = db.session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE)).scalars()
+            for obj in rows:
+                yield json.dumps(serialize(obj)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    items = [serialize(obj) for obj in db.session.execute(query).scalars()]
+    resp = jsonify(items)
+    if limit is not None and len(items) == limit:
+        resp.headers['X-Next-After'] = str(items[-1]['id'])
+    return resp
+
+
+def read_bulk_rows():
+    """Wczytuje ciało żądania importu: tablicę JSON albo NDJSON (Content-Type: application/x-ndjson).
+
+    Zwraca (wiersze, błędy); wiersz, którego nie da się sparsować, trafia od razu do błędów.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        rows, errors = [], []
+        for index, line in enumerate(io.BufferedReader(request.stream, 1 << 16)):
+            if not line.strip():
+                continue
+            try:
+                rows.append((index, json.loads(line)))
+            except ValueError:
+                errors.append({'index': index, 'błąd': 'Nieprawidłowy JSON'})
+        return rows, errors
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return None, None
+    return list(enumerate(data)), []
+
+
+def bulk_insert(model, rows):
+    # każda partia to jedno executemany w osobnej transakcji
+    for start in range(0, len(rows), BULK_BATCH_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + BULK_BATCH_SIZE])
+        db.session.commit()
+
+
+def member_to_dict(m):
+    return {'id': m.id, 'name': m.name, 'email': m.email}
+
+
+def book_to_dict(b):
+    return {
+        'id': b.id,
+        'title': b.title,
+        'author': b.author,
+        'copies': b.copies,
+        'available': max(b.copies - b.active_loans, 0)
+    }
+
+
+def overdue_to_dict(row, today):
+    return {
+        'id': row.id,
+        'member_id': row.member_id,
+        'member_name': row.member_name,
+        'book_id': row.book_id,
+        'book_title': row.book_title,
+        'loan_date': row.loan_date.isoformat(),
+        'due_date': row.due_date.isoformat(),
+        'days_overdue': (today - row.due_date).days
+    }
+
+
+def loan_to_dict(l):
+    return {
+        'id': l.id,
+        'member_id': l.member_id,
+        'book_id': l.book_id,
+        'loan_date': l.loan_date.isoformat(),
+        'due_date': l.due_date.isoformat(),
+        'return_date': l.return_date.isoformat() if l.return_date else None
+    }
 
 @app.route('/')
 def home():
@@ -19,8 +128,7 @@ def home():
 # ----- KLIENCI -----
 @app.route('/api/members', methods=['GET'])
 def get_members():
-    members = Member.query.all()
-    return jsonify([{'id': m.id, 'name': m.name, 'email': m.email} for m in members])
+    return list_response(Member, member_to_dict)
 
 @app.route('/api/members', methods=['POST'])
 def add_member():
@@ -36,22 +144,40 @@ def add_member():
     db.session.commit()
     return jsonify({'id': member.id}), 201
 
+@app.route('/api/members/bulk', methods=['POST'])
+def add_members_bulk():
+    rows, errors = read_bulk_rows()
+    if rows is None:
+        return jsonify({'błąd': 'Oczekiwano tablicy JSON lub NDJSON'}), 400
+
+    valid = []
+    for index, data in rows:
+        if not isinstance(data, dict) or not data.get('name') or not data.get('email'):
+            errors.append({'index': index, 'błąd': 'Nie dodano imienia lub adresu email'})
+            continue
+        valid.append((index, {'name': str(data['name']), 'email': str(data['email'])}))
+
+    # jedno zapytanie o wszystkie adresy z importu zamiast filter_by(email=...) dla każdego wiersza
+    # (json_each pozwala przekazać całą listę jednym parametrem, bez limitu liczby zmiennych SQLite)
+    emails = db.select(db.column('value')).select_from(db.func.json_each(json.dumps([m['email'] for _, m in valid])))
+    taken = set(db.session.execute(db.select(Member.email).where(Member.email.in_(emails))).scalars())
+
+    to_insert = []
+    for index, member in valid:
+        if member['email'] in taken:
+            errors.append({'index': index, 'błąd': 'Ten adres email już istnieje'})
+            continue
+        taken.add(member['email'])
+        to_insert.append(member)
+
+    bulk_insert(Member, to_insert)
+    errors.sort(key=lambda e: e['index'])
+    return jsonify({'inserted': len(to_insert), 'errors': errors}), 200
+
 # ----- KSIĄZKI -----
 @app.route('/api/books', methods=['GET'])
 def get_books():
-    books = Book.query.all()
-    result = []
-    for b in books:
-        active_loans = Loan.query.filter_by(book_id=b.id, return_date=None).count()
-        available = max(b.copies - active_loans, 0)
-        result.append({
-            'id': b.id,
-            'title': b.title,
-            'author': b.author,
-            'copies': b.copies,
-            'available': available
-        })
-    return jsonify(result)
+    return list_response(Book, book_to_dict)
 
 @app.route('/api/books', methods=['POST'])
 def add_book():
@@ -65,14 +191,34 @@ def add_book():
     db.session.commit()
     return jsonify({'id': book.id}), 201
 
+@app.route('/api/books/bulk', methods=['POST'])
+def add_books_bulk():
+    rows, errors = read_bulk_rows()
+    if rows is None:
+        return jsonify({'błąd': 'Oczekiwano tablicy JSON lub NDJSON'}), 400
+
+    to_insert = []
+    for index, data in rows:
+        if not isinstance(data, dict) or not data.get('title') or not data.get('author'):
+            errors.append({'index': index, 'błąd': 'Nie znaleziona autora lub tytułu.'})
+            continue
+        copies = data.get('copies', 1)
+        if not isinstance(copies, int) or isinstance(copies, bool) or copies < 1:
+            errors.append({'index': index, 'błąd': 'Liczba kopii musi być dodatnią liczbą całkowitą'})
+            continue
+        to_insert.append({'title': str(data['title']), 'author': str(data['author']), 'copies': copies})
+
+    bulk_insert(Book, to_insert)
+    errors.sort(key=lambda e: e['index'])
+    return jsonify({'inserted': len(to_insert), 'errors': errors}), 200
+
 @app.route('/api/books/<int:book_id>', methods=['DELETE'])
 def delete_book(book_id):
     book = Book.query.get(book_id)
     if not book:
         return jsonify({'błąd': f'książka z id={book_id} nie została znaleziona'}), 404
 
-    active_loans = Loan.query.filter_by(book_id=book.id, return_date=None).count()
-    if active_loans > 0:
+    if book.active_loans > 0:
         return jsonify({'bład': 'Nie można usunąć, książka jest wypożyczona!'}), 409
 
     db.session.delete(book)
@@ -83,15 +229,27 @@ def delete_book(book_id):
 # ----- WYPOŻYCZENIA -----
 @app.route('/api/loans', methods=['GET'])
 def get_loans():
-    loans = Loan.query.all()
-    return jsonify([{
-        'id': l.id,
-        'member_id': l.member_id,
-        'book_id': l.book_id,
-        'loan_date': l.loan_date.isoformat(),
-        'due_date': l.due_date.isoformat(),
-        'return_date': l.return_date.isoformat() if l.return_date else None
-    } for l in loans])
+    return list_response(Loan, loan_to_dict)
+
+@app.route('/api/loans/overdue', methods=['GET'])
+def get_overdue_loans():
+    # kursor ma postać "<due_date>,<id>", np. ?after=2025-01-31,42
+    after = request.args.get('after')
+    if after:
+        try:
+            due, loan_id = after.split(',')
+            after = (date.fromisoformat(due), int(loan_id))
+        except ValueError:
+            return jsonify({'błąd': 'Nieprawidłowy kursor, oczekiwano after=RRRR-MM-DD,id'}), 400
+    limit = request.args.get('limit', default=DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    today = date.today()
+    rows = db.session.execute(overdue_loans_query(today, after or None).limit(limit)).all()
+    resp = jsonify([overdue_to_dict(r, today) for r in rows])
+    if len(rows) == limit:
+        resp.headers['X-Next-After'] = f'{rows[-1].due_date.isoformat()},{rows[-1].id}'
+    return resp
 
 @app.route('/api/loans/borrow', methods=['POST'])
 def borrow_book():
@@ -101,8 +259,14 @@ def borrow_book():
     if not member or not book:
         return jsonify({'error': 'Książka lub Klient nie został znaleziony'}), 404
 
-    active_loans = Loan.query.filter_by(book_id=book.id, return_date=None).count()
-    if active_loans >= book.copies:
+    # warunkowy UPDATE rezerwuje egzemplarz atomowo, więc równoległe wypożyczenia nie przekroczą copies
+    reserved = db.session.execute(
+        db.update(Book)
+        .where(Book.id == book.id, Book.active_loans < Book.copies)
+        .values(active_loans=Book.active_loans + 1)
+    ).rowcount
+    if not reserved:
+        db.session.rollback()
         return jsonify({'błąd': 'Nie ma już kopii'}), 409
 
     loan = Loan(member_id=member.id, book_id=book.id,
@@ -121,9 +285,58 @@ def return_book():
     if loan.return_date:
         return jsonify({'błąd': 'Książka została już zwrócona'}), 409
 
-    loan.return_date = date.today()
+    returned = db.session.execute(
+        db.update(Loan)
+        .where(Loan.id == loan.id, Loan.return_date.is_(None))
+        .values(return_date=date.today())
+    ).rowcount
+    if not returned:
+        db.session.rollback()
+        return jsonify({'błąd': 'Książka została już zwrócona'}), 409
+
+    db.session.execute(
+        db.update(Book)
+        .where(Book.id == loan.book_id, Book.active_loans > 0)
+        .values(active_loans=Book.active_loans - 1)
+    )
     db.session.commit()
     return jsonify({'status': 'ok'}), 200
 
+
+@app.cli.command('reconcile-loans')
+def reconcile_loans():
+    """Odbudowuje licznik active_loans z tabeli Loan i wypisuje wykryte rozbieżności."""
+    drift = rebuild_active_loans()
+    for book_id, stored, actual in drift:
+        print(f'książka {book_id}: zapisano {stored}, faktycznie {actual}')
+    print(f'Rozbieżności: {len(drift)}')
+
+
+@app.cli.command('overdue-report')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--chunk-size', default=5000, show_default=True, help='Liczba wierszy pobieranych jednym zapytaniem.')
+def overdue_report(path, chunk_size):
+    """Zapisuje raport przeterminowanych wypożyczeń do pliku CSV.
+
+    Wiersze są pobierane stronami (keyset po due_date, id), więc każda partia to krótkie zapytanie po indeksie
+    ix_loan_open_due_date, a w pamięci jest naraz najwyżej chunk_size wierszy.
+    """
+    today = date.today()
+    fields = ['id', 'member_id', 'member_name', 'book_id', 'book_title', 'loan_date', 'due_date', 'days_overdue']
+    written = 0
+    after = None
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        while True:
+            rows = db.session.execute(overdue_loans_query(today, after).limit(chunk_size)).all()
+            if not rows:
+                break
+            writer.writerows(overdue_to_dict(r, today) for r in rows)
+            written += len(rows)
+            after = (rows[-1].due_date, rows[-1].id)
+            db.session.expunge_all()
+    print(f'Zapisano {written} przeterminowanych wypożyczeń do {path}')
+
 if __name__ == '__main__':
     app.run(debug=True)
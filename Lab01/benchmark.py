@@ -0,0 +1,87 @@
+"""Pomiar czasu odpowiedzi GET /api/books na sztucznie wygenerowanej bazie.
+
+Uruchomienie (tworzy osobną, tymczasową bazę - library.db nie jest ruszana):
+
+    python benchmark.py --books 20000 --loans 50000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args()
+
+
+def seed(db, Member, Book, Loan, rebuild_active_loans, books, loans):
+    db.session.execute(db.insert(Member), [
+        {'name': f'Czytelnik {i}', 'email': f'reader{i}@example.com'} for i in range(100)
+    ])
+    db.session.execute(db.insert(Book), [
+        {'title': f'Książka {i}', 'author': f'Autor {i % 500}', 'copies': random.randint(1, 5)}
+        for i in range(books)
+    ])
+    today = date.today()
+    rows = []
+    for i in range(loans):
+        loan_date = today - timedelta(days=random.randint(0, 60))
+        returned = random.random() < 0.8
+        rows.append({
+            'member_id': random.randint(1, 100),
+            'book_id': random.randint(1, books),
+            'loan_date': loan_date,
+            'due_date': loan_date + timedelta(days=14),
+            'return_date': loan_date + timedelta(days=7) if returned else None,
+        })
+    db.session.execute(db.insert(Loan), rows)
+    db.session.commit()
+    rebuild_active_loans()
+
+
+def legacy_books(Book, Loan):
+    # poprzednia implementacja: osobny COUNT dla każdej książki (N+1)
+    result = []
+    for b in Book.query.all():
+        active_loans = Loan.query.filter_by(book_id=b.id, return_date=None).count()
+        result.append({'id': b.id, 'available': max(b.copies - active_loans, 0)})
+    return result
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings)
+
+
+def main():
+    args = parse_args()
+    tmp_dir = tempfile.mkdtemp()
+    os.environ['LIBRARY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+
+    from app import app
+    from models import db, Member, Book, Loan, rebuild_active_loans
+
+    with app.app_context():
+        seed(db, Member, Book, Loan, rebuild_active_loans, args.books, args.loans)
+
+        best, avg = measure(lambda: legacy_books(Book, Loan), args.repeat)
+        print(f'przed (N+1):            min {best * 1000:8.1f} ms   avg {avg * 1000:8.1f} ms')
+
+    client = app.test_client()
+    best, avg = measure(lambda: client.get('/api/books'), args.repeat)
+    print(f'po (licznik w Book):  min {best * 1000:8.1f} ms   avg {avg * 1000:8.1f} ms')
+    print(f'książek: {args.books}, wypożyczeń: {args.loans}, powtórzeń: {args.repeat}')
+
+
+if __name__ == '__main__':
+    main()
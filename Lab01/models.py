@@ -12,11 +12,85 @@ class Book(db.Model):
     title = db.Column(db.String(200), nullable=False)
     author = db.Column(db.String(200), nullable=False)
     copies = db.Column(db.Integer, nullable=False, default=1)
+    # licznik otwartych wypożyczeń utrzymywany przez borrow/return, odbudowywany przez rebuild_active_loans
+    active_loans = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 class Loan(db.Model):
+    __table_args__ = (
+        db.Index('ix_loan_book_id_return_date', 'book_id', 'return_date'),
+        # częściowy indeks tylko na otwartych wypożyczeniach - raport przeterminowanych nie dotyka historii
+        db.Index('ix_loan_open_due_date', 'due_date', 'id', 'member_id', 'book_id',
+                 sqlite_where=db.text('return_date IS NULL')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     member_id = db.Column(db.Integer, db.ForeignKey('member.id'), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey('book.id'), nullable=False)
     loan_date = db.Column(db.Date, nullable=False)
     due_date = db.Column(db.Date, nullable=False)
     return_date = db.Column(db.Date, nullable=True)
+
+
+def _add_missing_columns():
+    inspector = db.inspect(db.engine)
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+                conn.execute(db.text(ddl))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def init_schema():
+    # create_all nie dodaje kolumn ani indeksów do istniejących tabel, więc dla starych baz robimy to ręcznie
+    db.create_all()
+    added = _add_missing_columns()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    if 'book.active_loans' in added:
+        rebuild_active_loans()
+
+
+def _open_loans_count():
+    return (db.select(db.func.count(Loan.id))
+            .where(Loan.book_id == Book.id, Loan.return_date.is_(None))
+            .scalar_subquery())
+
+
+def overdue_loans_query(today, after=None):
+    """Otwarte wypożyczenia z terminem przed `today` razem z nazwą czytelnika i tytułem książki.
+
+    Sortowane po (due_date, id); `after` to para (due_date, id) ostatniego wiersza poprzedniej strony.
+    """
+    query = (db.select(Loan.id, Loan.member_id, Member.name.label('member_name'),
+                       Loan.book_id, Book.title.label('book_title'),
+                       Loan.loan_date, Loan.due_date)
+             .join(Member, Member.id == Loan.member_id)
+             .join(Book, Book.id == Loan.book_id)
+             .where(Loan.return_date.is_(None), Loan.due_date < today)
+             .order_by(Loan.due_date, Loan.id))
+    if after is not None:
+        query = query.where(db.tuple_(Loan.due_date, Loan.id) > after)
+    return query
+
+
+def rebuild_active_loans():
+    """Przelicza Book.active_loans na podstawie tabeli Loan.
+
+    Zwraca listę (book_id, zapisana wartość, faktyczna wartość) dla książek, w których licznik się rozjechał.
+    """
+    actual = _open_loans_count()
+    drift = db.session.execute(
+        db.select(Book.id, Book.active_loans, actual).where(Book.active_loans != actual)
+    ).all()
+    db.session.execute(db.update(Book).values(active_loans=_open_loans_count()))
+    db.session.commit()
+    return [tuple(row) for row in drift]
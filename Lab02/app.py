@@ -1,12 +1,20 @@
-from flask import Flask, request, jsonify
-import sqlite3
-from datetime import datetime, UTC
+from flask import Flask, request, jsonify, g
+import os
+import re
+import uuid
+from datetime import date, datetime, UTC
 from pathlib import Path
 
+import db_connection
+import http_cache
+from cache import TTLCache
+from cart_store import Cart, make_cart_store
 from db_initiation import init_db
 
 app = Flask(__name__, static_folder="static", static_url_path="/")
 app.url_map.strict_slashes = False   
+db_connection.init_app(app)
+http_cache.init_app(app)
 
 DB_PATH = Path("instance/shop.db")
 DB_PATH.parent.mkdir(exist_ok=True)
@@ -14,21 +22,57 @@ DB_PATH.parent.mkdir(exist_ok=True)
 
 init_db()
 
+# "memory" (single worker) or "sqlite" (shared by all workers)
+CART_BACKEND = os.environ.get("CART_BACKEND", "memory")
+CART_COOKIE = "cart_id"
+CART_SAVE_RETRIES = 5
+ORDERS_PAGE_SIZE = 50
+ORDERS_MAX_PAGE_SIZE = 500
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
 
-cart = {}
-applied_coupon = None  
-
+# read-through caches for load_product(s) / load_coupon; sizes can be tuned from /api/cache/stats
+product_cache = TTLCache(maxsize=10000, ttl=300)
+coupon_cache = TTLCache(maxsize=1000, ttl=300)
 
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_connection.get_request_connection(DB_PATH)
+
+
+cart_store = make_cart_store(CART_BACKEND, get_db)
+
+
+def get_cart_id():
+    cart_id = request.headers.get("X-Cart-Id") or request.cookies.get(CART_COOKIE)
+    if not cart_id:
+        cart_id = g.get("new_cart_id") or uuid.uuid4().hex
+        g.new_cart_id = cart_id
+    return cart_id
+
+
+def update_cart(mutate):
+    """
+    Loads the cart, applies mutate(cart) and saves it with a version check,
+    retrying when another request changed the same cart in the meantime.
+    mutate returns None on success or an error response to stop.
+    """
+    cart_id = get_cart_id()
+    for _ in range(CART_SAVE_RETRIES):
+        cart = cart_store.load(cart_id)
+        error = mutate(cart)
+        if error is not None:
+            return cart, error
+        if cart_store.save(cart_id, cart):
+            return cart, None
+    return cart, (jsonify({"error": "Cart was modified concurrently, try again"}), 409)
 
 
 @app.after_request
 def add_headers(res):
     res.headers.setdefault("Cache-Control", "no-store")
+    if "new_cart_id" in g:
+        res.set_cookie(CART_COOKIE, g.new_cart_id, httponly=True, samesite="Lax")
     return res
 
 
@@ -39,13 +83,67 @@ def index():
 
 
 @app.route("/api/products", methods=["GET"])
+@http_cache.conditional(get_db, "products")
 def products_list():
     conn = get_db()
-    rows = conn.execute("SELECT id, name, price FROM products ORDER BY id").fetchall()
-    conn.close()
+    rows = conn.execute("SELECT id, name, price, stock FROM products ORDER BY id").fetchall()
     return jsonify([dict(r) for r in rows])
 
 
+@app.route("/api/products/search", methods=["GET"])
+@http_cache.conditional(get_db, "products")
+def products_search():
+    """
+    Query: ?q=&min_price=&max_price=&limit=&after=
+    Best matches first (FTS5 bm25 rank). Every word of q is matched as a prefix.
+    The cursor for the next page is returned in X-Next-After and passed back as ?after=.
+    """
+    terms = re.findall(r"\w+", request.args.get("q", ""))
+    if not terms:
+        return jsonify({"error": "q is required"}), 400
+    match = " ".join(f'"{term}"*' for term in terms)
+
+    min_price = request.args.get("min_price", type=float)
+    max_price = request.args.get("max_price", type=float)
+    limit = request.args.get("limit", default=SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+
+    sql = """
+        SELECT p.id, p.name, p.price, p.stock, f.rank
+        FROM products_fts f
+        JOIN products p ON p.id = f.rowid
+        WHERE products_fts MATCH ?
+    """
+    params = [match]
+
+    if min_price is not None:
+        sql += " AND p.price >= ?"
+        params.append(min_price)
+    if max_price is not None:
+        sql += " AND p.price <= ?"
+        params.append(max_price)
+
+    after = request.args.get("after")
+    if after:
+        try:
+            after_rank, after_id = after.split(":")
+            after_rank, after_id = float(after_rank), int(after_id)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        sql += " AND (f.rank > ? OR (f.rank = ? AND p.id > ?))"
+        params += [after_rank, after_rank, after_id]
+
+    sql += " ORDER BY f.rank, p.id LIMIT ?"
+    params.append(limit)
+
+    rows = get_db().execute(sql, params).fetchall()
+
+    res = jsonify([{k: r[k] for k in ("id", "name", "price", "stock")} for r in rows])
+    if len(rows) == limit:
+        res.headers["X-Next-After"] = f"{rows[-1]['rank']!r}:{rows[-1]['id']}"
+    return res
+
+
 @app.route("/api/products", methods=["POST"])
 def product_create():
     data = request.get_json(silent=True) or {}
@@ -63,41 +161,94 @@ def product_create():
     except Exception:
         return jsonify({"error": "Invalid price"}), 400
 
+    # stock is optional; null means the product is not stock-tracked
+    stock = data.get("stock")
+    if stock is not None:
+        if not isinstance(stock, int) or isinstance(stock, bool) or stock < 0:
+            return jsonify({"error": "Invalid stock"}), 400
+
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("INSERT INTO products (name, price) VALUES (?, ?)", (name, price))
+    cur.execute("INSERT INTO products (name, price, stock) VALUES (?, ?, ?)", (name, price, stock))
+    http_cache.bump_versions(conn, "products")
     conn.commit()
     product_id = cur.lastrowid
-    conn.close()
+    invalidate_product(product_id)
+
+    return jsonify({"id": product_id, "name": name, "price": price, "stock": stock}), 201
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "products": product_cache.stats(),
+        "coupons": coupon_cache.stats()
+    })
+
+
+def invalidate_product(pid: int):
+    """Must be called by every path that inserts or changes a product's name or price."""
+    product_cache.invalidate(pid)
 
-    return jsonify({"id": product_id, "name": name, "price": price}), 201
 
 def load_product(pid: int):
-    conn = get_db()
-    row = conn.execute(
-        "SELECT id, name, price FROM products WHERE id = ?",
-        (pid,)
-    ).fetchone()
-    conn.close()
-    return row
+    return load_products([pid]).get(pid)
+
+
+def load_products(pids, use_cache=True):
+    """
+    Fetches many products, missing ones with one query; returns {id: row}.
+    use_cache=False always reads the database (checkout prices the order from it).
+    """
+    found = {}
+    missing = []
+    for pid in pids:
+        row = product_cache.get(pid) if use_cache else None
+        if row is None:
+            missing.append(pid)
+        else:
+            found[pid] = row
+
+    if missing:
+        placeholders = ",".join("?" * len(missing))
+        rows = get_db().execute(
+            f"SELECT id, name, price FROM products WHERE id IN ({placeholders})",
+            missing
+        ).fetchall()
+        for row in rows:
+            product_cache.put(row["id"], row)
+            found[row["id"]] = row
+
+    return found
+
+
+def has_stock(pid: int, qty: int):
+    row = get_db().execute("SELECT stock FROM products WHERE id = ?", (pid,)).fetchone()
+    return row is not None and (row["stock"] is None or row["stock"] >= qty)
 
 
 def load_coupon(code: str):
-    conn = get_db()
-    row = conn.execute(
-        "SELECT code, percent FROM coupons WHERE UPPER(code) = UPPER(?)",
-        (code,)
-    ).fetchone()
-    conn.close()
+    key = code.upper()
+    row = coupon_cache.get(key)
+    if row is None:
+        # COLLATE NOCASE matches idx_coupons_code_nocase, UPPER(code) could not use an index
+        row = get_db().execute(
+            "SELECT code, percent FROM coupons WHERE code = ? COLLATE NOCASE",
+            (code,)
+        ).fetchone()
+        if row is not None:
+            coupon_cache.put(key, row)
     return row
 
 
-def compute_cart_summary():
+def compute_cart_summary(cart_items, use_cache=True):
     items = []
     total = 0.0
 
-    for pid, qty in cart.items():
-        product = load_product(int(pid))
+    products = load_products([int(pid) for pid in cart_items], use_cache)
+
+    for pid, qty in cart_items.items():
+        product = products.get(int(pid))
         if not product:
             continue
 
@@ -124,9 +275,8 @@ def validate_qty(data):
     except Exception:
         return None
 
-@app.route("/api/cart", methods=["GET"])
-def cart_get():
-    items, total = compute_cart_summary()
+def cart_response(cart):
+    items, total = compute_cart_summary(cart.items)
 
     result = {
         "items": items,
@@ -135,15 +285,20 @@ def cart_get():
         "total_with_discount": total
     }
 
-    if applied_coupon:
-        percent = applied_coupon["percent"]
+    if cart.coupon:
+        percent = cart.coupon["percent"]
         discount = total * (percent / 100)
-        result["coupon"] = applied_coupon
+        result["coupon"] = cart.coupon
         result["total_with_discount"] = total - discount
 
     return jsonify(result)
 
 
+@app.route("/api/cart", methods=["GET"])
+def cart_get():
+    return cart_response(cart_store.load(get_cart_id()))
+
+
 @app.route("/api/cart/add", methods=["POST"])
 def cart_add():
     data = request.get_json(silent=True) or {}
@@ -160,9 +315,11 @@ def cart_add():
     if not load_product(pid):
         return jsonify({"error": "Product not found"}), 404
 
-    cart[str(pid)] = cart.get(str(pid), 0) + qty
+    def add(cart):
+        cart.items[str(pid)] = cart.items.get(str(pid), 0) + qty
 
-    return cart_get()
+    cart, error = update_cart(add)
+    return error or cart_response(cart)
 
 
 @app.route("/api/cart/item", methods=["PATCH"])
@@ -178,21 +335,24 @@ def cart_patch():
     if qty is None:
         return jsonify({"error": "qty must be > 0"}), 400
 
-    if str(pid) not in cart:
-        return jsonify({"error": "Item not in cart"}), 404
+    def patch(cart):
+        if str(pid) not in cart.items:
+            return jsonify({"error": "Item not in cart"}), 404
+        cart.items[str(pid)] = qty
 
-    cart[str(pid)] = qty
-
-    return cart_get()
+    cart, error = update_cart(patch)
+    return error or cart_response(cart)
 
 
 @app.route("/api/cart/item/<int:pid>", methods=["DELETE"])
 def cart_delete(pid):
-    if str(pid) not in cart:
-        return jsonify({"error": "Item not in cart"}), 404
+    def delete(cart):
+        if str(pid) not in cart.items:
+            return jsonify({"error": "Item not in cart"}), 404
+        del cart.items[str(pid)]
 
-    del cart[str(pid)]
-    return cart_get()
+    cart, error = update_cart(delete)
+    return error or cart_response(cart)
 
 @app.route("/api/cart/apply-coupon", methods=["POST"])
 @app.route("/api/cart/apply-coupon/", methods=["POST"])
@@ -200,8 +360,6 @@ def cart_apply_coupon():
     """
     Body: { "code": "PROMO10" }
     """
-    global applied_coupon
-
     data = request.get_json(silent=True) or {}
     code = (data.get("code") or "").strip()
 
@@ -209,58 +367,94 @@ def cart_apply_coupon():
         return jsonify({"error": "Coupon code is required"}), 400
 
     coupon = load_coupon(code)
+    applied = {"code": coupon["code"], "percent": coupon["percent"]} if coupon else None
 
+    def apply(cart):
+        cart.coupon = applied
+
+    cart, error = update_cart(apply)
+    if error:
+        return error
     if not coupon:
-        applied_coupon = None
         return jsonify({"error": "Coupon not found"}), 404
 
-    applied_coupon = {"code": coupon["code"], "percent": coupon["percent"]}
-
-    items, total = compute_cart_summary()
-    percent = applied_coupon["percent"]
-    total_after = total - (total * percent / 100)
-
-    return jsonify({
-        "items": items,
-        "total": total,
-        "coupon": applied_coupon,
-        "total_with_discount": total_after
-    })
+    return cart_response(cart)
 
 
 @app.route("/api/checkout", methods=["POST"])
 def checkout():
-    global applied_coupon
+    cart_id = get_cart_id()
+    cart = cart_store.load(cart_id)
 
-    if not cart:
+    if not cart.items:
         return jsonify({"error": "Cart empty"}), 400
 
-    items, total = compute_cart_summary()
-
     conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        "INSERT INTO orders (created_at) VALUES (?)",
-        (datetime.now(UTC).isoformat(),)
-    )
-    order_id = cur.lastrowid
+    claimed = False
+    # BEGIN IMMEDIATE takes the write lock up front: prices are re-read, stock is reserved
+    # and the order is written in one transaction, so concurrent checkouts cannot oversell
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        items, subtotal = compute_cart_summary(cart.items, use_cache=False)
+
+        cur = conn.cursor()
+        cur.executemany(
+            "UPDATE products SET stock = stock - ? WHERE id = ? AND (stock IS NULL OR stock >= ?)",
+            [(item["qty"], item["product_id"], item["qty"]) for item in items]
+        )
+        if cur.rowcount != len(items):
+            conn.rollback()
+            short = [item["product_id"] for item in items
+                     if not has_stock(item["product_id"], item["qty"])]
+            return jsonify({"error": "Insufficient stock", "product_ids": short}), 409
+
+        discount = 0
+        coupon_code = None
+        if cart.coupon:
+            coupon_code = cart.coupon["code"]
+            discount = subtotal * cart.coupon["percent"] / 100
+        total_to_pay = subtotal - discount
+
+        created_at = datetime.now(UTC).isoformat()
 
-    for item in items:
         cur.execute("""
+            INSERT INTO orders (created_at, subtotal, coupon_code, discount, total)
+            VALUES (?, ?, ?, ?, ?)
+        """, (created_at, subtotal, coupon_code, discount, total_to_pay))
+        order_id = cur.lastrowid
+
+        cur.executemany("""
             INSERT INTO order_items (order_id, product_id, qty, price)
             VALUES (?, ?, ?, ?)
-        """, (order_id, item["product_id"], item["qty"], item["unit_price"]))
-
-    conn.commit()
-    conn.close()
+        """, [(order_id, item["product_id"], item["qty"], item["unit_price"]) for item in items])
 
-    total_to_pay = total
-    if applied_coupon:
-        total_to_pay = total * (1 - applied_coupon["percent"] / 100)
-
-    cart.clear()
-    applied_coupon = None
+        # rollup is updated in the same transaction as the order
+        cur.execute("""
+            INSERT INTO daily_sales (day, orders, subtotal, discount, total)
+            VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT(day) DO UPDATE SET
+                orders = orders + 1,
+                subtotal = subtotal + excluded.subtotal,
+                discount = discount + excluded.discount,
+                total = total + excluded.total
+        """, (created_at[:10], subtotal, discount, total_to_pay))
+
+        http_cache.bump_versions(conn, "products", "orders")
+
+        # claim the cart: a concurrent checkout of the same cart, or a cart changed since it was loaded,
+        # makes this fail, so each cart version becomes at most one order
+        claimed = cart_store.delete(cart_id, cart.version)
+        if not claimed:
+            conn.rollback()
+            return jsonify({"error": "Cart was modified or already checked out, try again"}), 409
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if claimed:
+            # the in-memory store is outside the transaction, put the cart back
+            cart_store.save(cart_id, Cart(cart.items, cart.coupon))
+        raise
 
     return jsonify({
         "order_id": order_id,
@@ -269,45 +463,105 @@ def checkout():
 
 
 @app.route("/api/orders", methods=["GET"])
+@http_cache.conditional(get_db, "orders", "products")
 def orders_list():
-    conn = get_db()
-    cur = conn.cursor()
-
-    rows = cur.execute("SELECT id, created_at FROM orders ORDER BY id DESC").fetchall()
+    """
+    Newest orders first. Without parameters returns all orders;
+    ?before_id=&limit= returns one page, the cursor for the next one is in X-Next-Before-Id.
+    """
+    before_id = request.args.get("before_id", type=int)
+    limit = request.args.get("limit", type=int)
+    if before_id is not None and limit is None:
+        limit = ORDERS_PAGE_SIZE
+
+    page_sql = "SELECT id, created_at, subtotal, coupon_code, discount, total FROM orders"
+    params = []
+    if before_id is not None:
+        page_sql += " WHERE id < ?"
+        params.append(before_id)
+    page_sql += " ORDER BY id DESC"
+    if limit is not None:
+        limit = max(1, min(limit, ORDERS_MAX_PAGE_SIZE))
+        page_sql += " LIMIT ?"
+        params.append(limit)
+
+    # one query for the whole page; rows arrive grouped by order and are folded as they stream in,
+    # totals come from the values stored at checkout
+    rows = get_db().execute(f"""
+        SELECT o.id, o.created_at, o.subtotal, o.coupon_code, o.discount, o.total,
+               oi.product_id, p.name, oi.qty, oi.price
+        FROM ({page_sql}) o
+        LEFT JOIN (order_items oi JOIN products p ON p.id = oi.product_id)
+            ON oi.order_id = o.id
+        ORDER BY o.id DESC, oi.id
+    """, params)
 
     result = []
+    order = None
     for r in rows:
-        items_rows = cur.execute("""
-            SELECT oi.product_id, p.name, oi.qty, oi.price
-            FROM order_items oi
-            JOIN products p ON p.id = oi.product_id
-            WHERE oi.order_id = ?
-        """, (r["id"],)).fetchall()
-
-        order_items = []
-        total = 0
-
-        for it in items_rows:
-            line_total = it["qty"] * it["price"]
-            total += line_total
-
-            order_items.append({
-                "product_id": it["product_id"],
-                "name": it["name"],
-                "qty": it["qty"],
-                "unit_price_snapshot": it["price"],
-                "line_total": line_total
-            })
-
-        result.append({
-            "id": r["id"],
-            "created_at": r["created_at"],
-            "items": order_items,
-            "total": total
+        if order is None or order["id"] != r["id"]:
+            order = {
+                "id": r["id"],
+                "created_at": r["created_at"],
+                "items": [],
+                "subtotal": r["subtotal"],
+                "coupon_code": r["coupon_code"],
+                "discount": r["discount"],
+                "total": r["total"]
+            }
+            result.append(order)
+
+        if r["product_id"] is None:
+            continue
+
+        order["items"].append({
+            "product_id": r["product_id"],
+            "name": r["name"],
+            "qty": r["qty"],
+            "unit_price_snapshot": r["price"],
+            "line_total": r["qty"] * r["price"]
         })
 
-    conn.close()
-    return jsonify(result)
+    res = jsonify(result)
+    if limit is not None and len(result) == limit:
+        res.headers["X-Next-Before-Id"] = str(result[-1]["id"])
+    return res
+
+
+@app.route("/api/reports/sales", methods=["GET"])
+@http_cache.conditional(get_db, "orders")
+def sales_report():
+    """
+    Query: ?from=YYYY-MM-DD&to=YYYY-MM-DD (both inclusive, optional).
+    Reads only the daily_sales rollup, so the cost grows with the number of days, not orders.
+    """
+    day_from = request.args.get("from")
+    day_to = request.args.get("to")
+    try:
+        for day in (day_from, day_to):
+            if day:
+                date.fromisoformat(day)
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+
+    sql = "SELECT day, orders, subtotal, discount, total FROM daily_sales WHERE 1 = 1"
+    params = []
+    if day_from:
+        sql += " AND day >= ?"
+        params.append(day_from)
+    if day_to:
+        sql += " AND day <= ?"
+        params.append(day_to)
+    sql += " ORDER BY day"
+
+    days = [dict(r) for r in get_db().execute(sql, params)]
+    summary = {
+        "orders": sum(d["orders"] for d in days),
+        "subtotal": sum(d["subtotal"] for d in days),
+        "discount": sum(d["discount"] for d in days),
+        "total": sum(d["total"] for d in days)
+    }
+    return jsonify({"from": day_from, "to": day_to, "days": days, "summary": summary})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+"""Benchmarks for the shop API, run against a scratch database in a temporary directory.
+
+instance/shop.db is not touched.
+
+    # latency of GET /api/cart and POST /api/checkout for carts of different sizes
+    python benchmark.py cart --lines 1 50 500 --repeat 20
+
+    # many workers checking out the same product with limited stock
+    python benchmark.py hot-sku --workers 16 --stock 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cart = commands.add_parser("cart", help="cart and checkout latency by cart size")
+    cart.add_argument("--lines", type=int, nargs="+", default=[1, 50, 500])
+    cart.add_argument("--repeat", type=int, default=20)
+
+    hot = commands.add_parser("hot-sku", help="concurrent checkouts of one product")
+    hot.add_argument("--workers", type=int, default=16)
+    hot.add_argument("--stock", type=int, default=500)
+
+    return parser.parse_args()
+
+
+def load_shop():
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, HERE)
+    import app as shop
+    return shop
+
+
+def add_products(shop, rows):
+    with shop.app.app_context():
+        conn = shop.get_db()
+        conn.executemany("INSERT INTO products (name, price, stock) VALUES (?, ?, ?)", rows)
+        conn.commit()
+
+
+def measure(fn, repeat, before=None):
+    timings = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[-1]
+
+
+def bench_cart(shop, args):
+    from cart_store import Cart
+
+    add_products(shop, [(f"Product {i}", 1 + i % 100, None) for i in range(max(args.lines))])
+
+    client = shop.app.test_client()
+    headers = {"X-Cart-Id": "bench"}
+
+    print(f"{'lines':>6} {'endpoint':<18} {'median ms':>10} {'max ms':>10}")
+    for lines in args.lines:
+        items = {str(pid): 1 for pid in range(1, lines + 1)}
+
+        def fill_cart():
+            with shop.app.app_context():
+                shop.cart_store.delete("bench")
+                shop.cart_store.save("bench", Cart(dict(items)))
+
+        fill_cart()
+        results = {
+            "GET /api/cart": measure(lambda: client.get("/api/cart", headers=headers), args.repeat),
+            "POST /api/checkout": measure(lambda: client.post("/api/checkout", headers=headers),
+                                          args.repeat, before=fill_cart),
+        }
+        for name, (median, worst) in results.items():
+            print(f"{lines:>6} {name:<18} {median * 1000:>10.2f} {worst * 1000:>10.2f}")
+
+
+def bench_hot_sku(shop, args):
+    add_products(shop, [("Hot product", 10, args.stock)])
+
+    sold = []
+    rejected = []
+    failed = []
+
+    def worker(n):
+        client = shop.app.test_client()
+        ok = errors = 0
+        i = 0
+        while True:
+            headers = {"X-Cart-Id": f"worker-{n}-{i}"}
+            i += 1
+            client.post("/api/cart/add", json={"product_id": 1, "qty": 1}, headers=headers)
+            res = client.post("/api/checkout", headers=headers)
+            if res.status_code == 201:
+                ok += 1
+            elif res.status_code == 409:
+                rejected.append(n)
+                break
+            else:
+                errors += 1
+                if errors > 100:
+                    break
+        sold.append(ok)
+        failed.append(errors)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with shop.app.app_context():
+        conn = shop.get_db()
+        stock_left = conn.execute("SELECT stock FROM products WHERE id = 1").fetchone()["stock"]
+        ordered = conn.execute("SELECT IFNULL(SUM(qty), 0) FROM order_items WHERE product_id = 1").fetchone()[0]
+
+    print(f"workers: {args.workers}, initial stock: {args.stock}")
+    print(f"successful checkouts: {sum(sold)}, rejected (out of stock): {len(rejected)}, errors: {sum(failed)}")
+    print(f"stock left: {stock_left}, units in order_items: {ordered}")
+    print(f"oversold: {'YES' if ordered > args.stock or stock_left < 0 else 'no'}")
+    print(f"throughput: {sum(sold) / elapsed:.1f} checkouts/s ({elapsed:.2f} s)")
+
+
+def main():
+    args = parse_args()
+    shop = load_shop()
+    if args.command == "cart":
+        bench_cart(shop, args)
+    else:
+        bench_hot_sku(shop, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Cart:
+    items: dict = field(default_factory=dict)   # {"<product_id>": qty}
+    coupon: dict | None = None                  # {"code": ..., "percent": ...}
+    version: int = 0                            # 0 = cart not stored yet
+
+
+class MemoryCartStore:
+    """Carts kept in this process, evicted by LRU order and TTL.
+
+    Only suitable for a single worker; use SqliteCartStore when running several processes.
+    """
+
+    def __init__(self, max_carts=10000, ttl=3600):
+        self.max_carts = max_carts
+        self.ttl = ttl
+        self._carts = OrderedDict()   # cart_id -> (Cart, expires_at)
+        self._lock = threading.Lock()
+
+    def load(self, cart_id):
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            if entry is None:
+                return Cart()
+            cart, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._carts[cart_id]
+                return Cart()
+            self._carts.move_to_end(cart_id)
+            return Cart(dict(cart.items), cart.coupon, cart.version)
+
+    def save(self, cart_id, cart):
+        """Stores the cart if nobody saved it since it was loaded. Returns False on a version conflict."""
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            current = entry[0].version if entry else 0
+            if current != cart.version:
+                return False
+            cart.version += 1
+            self._carts[cart_id] = (Cart(dict(cart.items), cart.coupon, cart.version),
+                                    time.monotonic() + self.ttl)
+            self._carts.move_to_end(cart_id)
+            while len(self._carts) > self.max_carts:
+                self._carts.popitem(last=False)
+            return True
+
+    def delete(self, cart_id, version=None):
+        """
+        Removes the cart. With `version`, only if it is still the stored version;
+        returns False when the cart changed or is already gone.
+        """
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            if version is not None and (entry is None or entry[0].version != version):
+                return False
+            self._carts.pop(cart_id, None)
+            return True
+
+
+class SqliteCartStore:
+    """Carts stored in the `carts` table, shared by all workers using the same database file.
+
+    Concurrent writers are serialized with optimistic versioning (UPDATE ... WHERE version = ?).
+    get_conn returns the connection to use (owned by the caller, never closed here).
+    """
+
+    def __init__(self, get_conn, ttl=7 * 24 * 3600):
+        self.get_conn = get_conn
+        self.ttl = ttl
+
+    def load(self, cart_id):
+        row = self.get_conn().execute(
+            "SELECT data, version, updated_at FROM carts WHERE id = ?",
+            (cart_id,)
+        ).fetchone()
+        if row is None:
+            return Cart()
+        if row["updated_at"] + self.ttl < time.time():
+            # expired: start from an empty cart but keep the version so the next save overwrites the row
+            return Cart(version=row["version"])
+        data = json.loads(row["data"])
+        return Cart(data["items"], data["coupon"], row["version"])
+
+    def save(self, cart_id, cart):
+        """Stores the cart if nobody saved it since it was loaded. Returns False on a version conflict."""
+        data = json.dumps({"items": cart.items, "coupon": cart.coupon})
+        now = time.time()
+        conn = self.get_conn()
+        with conn:
+            if cart.version == 0:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO carts (id, data, version, updated_at) VALUES (?, ?, 1, ?)",
+                    (cart_id, data, now)
+                )
+                conn.execute("DELETE FROM carts WHERE updated_at < ?", (now - self.ttl,))
+            else:
+                cur = conn.execute(
+                    "UPDATE carts SET data = ?, version = version + 1, updated_at = ? "
+                    "WHERE id = ? AND version = ?",
+                    (data, now, cart_id, cart.version)
+                )
+        if cur.rowcount == 0:
+            return False
+        cart.version += 1
+        return True
+
+    def delete(self, cart_id, version=None):
+        """
+        Removes the cart. With `version`, only if it is still the stored version;
+        returns False when the cart changed or is already gone.
+        The versioned delete does not commit, so it belongs to the caller's open transaction
+        (checkout claims the cart in the same transaction that writes the order).
+        """
+        conn = self.get_conn()
+        if version is not None:
+            cur = conn.execute("DELETE FROM carts WHERE id = ? AND version = ?", (cart_id, version))
+            return cur.rowcount == 1
+        with conn:
+            conn.execute("DELETE FROM carts WHERE id = ?", (cart_id,))
+        return True
+
+
+def make_cart_store(backend, get_conn):
+    if backend == "memory":
+        return MemoryCartStore()
+    if backend == "sqlite":
+        return SqliteCartStore(get_conn)
+    raise ValueError(f"Unknown cart backend: {backend}")
@@ -1,6 +1,8 @@
 import sqlite3
 from pathlib import Path
 
+from http_cache import create_version_table
+
 DB_PATH = Path("instance/shop.db")
 
 
@@ -12,14 +14,26 @@ def init_db():
         CREATE TABLE IF NOT EXISTS products (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
-            price REAL NOT NULL CHECK (price >= 0)
+            price REAL NOT NULL CHECK (price >= 0),
+            stock INTEGER CHECK (stock >= 0)
         );
     """)
 
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(products)")}
+    if "stock" not in columns:
+        # NULL stock = not tracked, so products created before this column stay purchasable
+        cur.execute("ALTER TABLE products ADD COLUMN stock INTEGER CHECK (stock >= 0)")
+
+    init_product_search(cur)
+
     cur.execute("""
         CREATE TABLE IF NOT EXISTS orders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT NOT NULL
+            created_at TEXT NOT NULL,
+            subtotal REAL NOT NULL DEFAULT 0,
+            coupon_code TEXT,
+            discount REAL NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0
         );
     """)
 
@@ -35,6 +49,23 @@ def init_db():
         );
     """)
 
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_order_items_order_id
+        ON order_items(order_id);
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            day TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL,
+            subtotal REAL NOT NULL,
+            discount REAL NOT NULL,
+            total REAL NOT NULL
+        );
+    """)
+
+    migrate_order_totals(cur)
+
     cur.execute("""
         CREATE TABLE IF NOT EXISTS coupons (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -43,6 +74,31 @@ def init_db():
         );
     """)
 
+    # coupon codes are matched case-insensitively
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_coupons_code_nocase
+        ON coupons(code COLLATE NOCASE);
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carts (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """)
+
+    # SqliteCartStore deletes expired carts when a new one is created; without this that is a full scan
+    # under the write lock
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_carts_updated_at
+        ON carts(updated_at);
+    """)
+
+    # validators for conditional GETs of product and order listings
+    create_version_table(cur, ("products", "orders"))
+
     cur.execute("SELECT COUNT(*) FROM coupons")
     count = cur.fetchone()[0]
 
@@ -58,3 +114,72 @@ def init_db():
 
     conn.commit()
     conn.close()
+
+
+def init_product_search(cur):
+    """
+    FTS5 index over product names (external content: the text lives only in products),
+    kept in sync by triggers. A newly created index is filled from existing products.
+    """
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+    ).fetchone()
+
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name,
+            content = 'products',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+    """)
+
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END;
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END;
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END;
+    """)
+
+    if not exists:
+        cur.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+def migrate_order_totals(cur):
+    """
+    Adds stored totals to orders created before they existed and rebuilds daily_sales.
+    Old orders are backfilled from order_items without a discount,
+    because the applied coupon was never recorded.
+    """
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(orders)")}
+    if "total" in columns:
+        return
+
+    cur.execute("ALTER TABLE orders ADD COLUMN subtotal REAL NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE orders ADD COLUMN coupon_code TEXT")
+    cur.execute("ALTER TABLE orders ADD COLUMN discount REAL NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE orders ADD COLUMN total REAL NOT NULL DEFAULT 0")
+    cur.execute("""
+        UPDATE orders SET subtotal = IFNULL((
+            SELECT SUM(qty * price) FROM order_items WHERE order_id = orders.id
+        ), 0)
+    """)
+    cur.execute("UPDATE orders SET total = subtotal")
+
+    cur.execute("DELETE FROM daily_sales")
+    cur.execute("""
+        INSERT INTO daily_sales (day, orders, subtotal, discount, total)
+        SELECT substr(created_at, 1, 10), COUNT(*), SUM(subtotal), SUM(discount), SUM(total)
+        FROM orders
+        GROUP BY substr(created_at, 1, 10)
+    """)
@@ -1,8 +1,16 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory
-import sqlite3
-from datetime import datetime
+from flask import Flask, Response, request, jsonify, send_from_directory
+import atexit
+import json
 import os
+import queue
+
+import db_connection
+import http_cache
+from db_initiation import init_db, migrate_db, now_timestamp
+from comment_queue import CommentWriter
+from events import EventBroker, format_event
+from render_cache import PayloadCache
 
 DB_PATH = "blog.db"
 
@@ -11,12 +19,43 @@ app = Flask(
     static_folder="static",
     static_url_path="/static"
 )
+db_connection.init_app(app)
+http_cache.init_app(app)
+
+POSTS_PAGE_SIZE = 20
+POSTS_MAX_PAGE_SIZE = 100
+EXCERPT_LENGTH = 200
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RETRY_MS = 3000
+# "sync" - komentarz zapisywany w żądaniu (201), "queue" - zapis w tle paczkami (202)
+COMMENT_WRITE_MODE = os.environ.get("COMMENT_WRITE_MODE", "sync")
+
+# zdarzenia o komentarzach dla /api/comments/stream
+comment_events = EventBroker()
+COMMENT_COLUMNS = "id, post_id, author, body, created_at, approved"
+
+# gotowe (także skompresowane) odpowiedzi list postów, postów i ich komentarzy
+payload_cache = PayloadCache(maxsize=1000)
+
+if not os.path.exists(DB_PATH):
+    init_db()
+migrate_db()
+
+
+def comments_created(comments):
+    for comment in comments:
+        comment_events.publish("comment-created", comment)
+
+
+comment_writer = None
+if COMMENT_WRITE_MODE == "queue":
+    comment_writer = CommentWriter(DB_PATH, on_flush=comments_created)
+    # przy zamykaniu procesu zapisujemy komentarze, które zostały w kolejce
+    atexit.register(comment_writer.close)
 
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_connection.get_request_connection(DB_PATH)
 
 
 @app.route("/")
@@ -36,13 +75,66 @@ def moderation_page():
 
 
 @app.get("/api/posts")
+@http_cache.conditional(get_db_connection, "posts", weak=True)
+@payload_cache.cached("posts")
 def list_posts():
+    # ?summary=1 -> zamiast pełnej treści pole excerpt (pierwsze EXCERPT_LENGTH znaków)
+    # ?limit=&after= -> stronicowanie po (created_at, id), kursor następnej strony w nagłówku X-Next-After
+    summary = request.args.get("summary") in ("1", "true")
+    limit = request.args.get("limit", type=int)
+    after = request.args.get("after")
+
+    if summary:
+        columns = (f"id, title, substr(body, 1, {EXCERPT_LENGTH}) AS excerpt, "
+                   f"length(body) > {EXCERPT_LENGTH} AS truncated, created_at")
+    else:
+        columns = "id, title, body, created_at"
+    columns += ", approved_comment_count, last_comment_at"
+
+    sql = f"SELECT {columns} FROM posts"
+    params = []
+    if after:
+        try:
+            after_created_at, after_id = after.rsplit(",", 1)
+            after_id = int(after_id)
+        except ValueError:
+            return jsonify({"error": "invalid cursor"}), 400
+        sql += " WHERE (created_at, id) < (?, ?)"
+        params += [after_created_at, after_id]
+        if limit is None:
+            limit = POSTS_PAGE_SIZE
+    sql += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        limit = max(1, min(limit, POSTS_MAX_PAGE_SIZE))
+        sql += " LIMIT ?"
+        params.append(limit)
+
     conn = get_db_connection()
-    posts = conn.execute(
-        "SELECT id, title, body, created_at FROM posts ORDER BY created_at DESC"
-    ).fetchall()
-    conn.close()
-    return jsonify([dict(p) for p in posts])
+    posts = [dict(p) for p in conn.execute(sql, params).fetchall()]
+    if summary:
+        for p in posts:
+            p["truncated"] = bool(p["truncated"])
+
+    res = jsonify(posts)
+    if limit is not None and len(posts) == limit:
+        res.headers["X-Next-After"] = f"{posts[-1]['created_at']},{posts[-1]['id']}"
+    return res
+
+
+@app.get("/api/posts/<int:post_id>")
+@http_cache.conditional(get_db_connection, "posts", weak=True)
+@payload_cache.cached("post")
+def get_post(post_id):
+    conn = get_db_connection()
+    post = conn.execute(
+        """
+        SELECT id, title, body, created_at, approved_comment_count, last_comment_at
+        FROM posts WHERE id = ?
+        """, (post_id,)
+    ).fetchone()
+    if post is None:
+        return jsonify({"error": "post not found"}), 404
+    return jsonify(dict(post))
 
 
 @app.post("/api/posts")
@@ -56,18 +148,22 @@ def create_post():
 
     conn = get_db_connection()
     cur = conn.cursor()
-    now = datetime.utcnow().isoformat()
+    now = now_timestamp()
     cur.execute(
         "INSERT INTO posts (title, body, created_at) VALUES (?, ?, ?)",
         (title, body, now)
     )
     post_id = cur.lastrowid
+    http_cache.bump_versions(conn, "posts")
     conn.commit()
-    conn.close()
+    payload_cache.invalidate("posts")
 
-    return jsonify({"id": post_id, "title": title, "body": body, "created_at": now}), 201
+    return jsonify({"id": post_id, "title": title, "body": body, "created_at": now,
+                    "approved_comment_count": 0, "last_comment_at": None}), 201
 
 @app.get("/api/posts/<int:post_id>/comments")
+@http_cache.conditional(get_db_connection, "comments", weak=True)
+@payload_cache.cached("comments")
 def list_approved_comments(post_id):
     conn = get_db_connection()
     comments = conn.execute("""
@@ -76,7 +172,6 @@ def list_approved_comments(post_id):
         WHERE post_id = ? AND approved = 1
         ORDER BY created_at ASC
     """, (post_id,)).fetchall()
-    conn.close()
     return jsonify([dict(c) for c in comments])
 
 
@@ -89,18 +184,33 @@ def create_comment(post_id):
     if not body:
         return jsonify({"error": "body is required"}), 400
 
+    now = now_timestamp()
+    if comment_writer is not None:
+        try:
+            provisional_id = comment_writer.submit(post_id, author, body, now)
+        except queue.Full:
+            res = jsonify({"error": "too many comments, try again later"})
+            res.headers["Retry-After"] = "1"
+            return res, 503
+        return jsonify({"provisional_id": provisional_id, "approved": 0}), 202
+
     conn = get_db_connection()
     cur = conn.cursor()
-    now = datetime.utcnow().isoformat()
     cur.execute("""
         INSERT INTO comments (post_id, author, body, created_at, approved)
         VALUES (?, ?, ?, ?, 0)
     """, (post_id, author, body, now))
     comment_id = cur.lastrowid
+    post = conn.execute("SELECT title FROM posts WHERE id = ?", (post_id,)).fetchone()
+    # nowy komentarz czeka na moderację - publiczne listy się nie zmieniają,
+    # więc bez bump_versions i bez czyszczenia payload_cache
     conn.commit()
-    conn.close()
 
-   
+    comments_created([{
+        "id": comment_id, "post_id": post_id, "post_title": post["title"] if post else None,
+        "author": author, "body": body, "created_at": now, "approved": 0
+    }])
+
     return jsonify({"id": comment_id, "approved": 0}), 201
 
 
@@ -116,7 +226,6 @@ def list_pending_comments():
         WHERE c.approved = 0
         ORDER BY c.created_at ASC
     """).fetchall()
-    conn.close()
     return jsonify([dict(c) for c in comments])
 
 
@@ -124,18 +233,124 @@ def list_pending_comments():
 def approve_comment(comment_id):
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("UPDATE comments SET approved = 1 WHERE id = ?", (comment_id,))
-    if cur.rowcount == 0:
-        conn.close()
-        return jsonify({"error": "comment not found"}), 404
+    cur.execute(f"UPDATE comments SET approved = 1 WHERE id = ? AND approved = 0 RETURNING {COMMENT_COLUMNS}",
+                (comment_id,))
+    rows = cur.fetchall()
+    if not rows:
+        conn.rollback()
+        if conn.execute("SELECT 1 FROM comments WHERE id = ?", (comment_id,)).fetchone() is None:
+            return jsonify({"error": "comment not found"}), 404
+        # już zatwierdzony - bez zmiany wersji, czyszczenia cache i ponownego zdarzenia
+        return jsonify({"status": "ok"}), 200
+    # triggery zmieniają też licznik komentarzy w posts
+    http_cache.bump_versions(conn, "comments", "posts")
     conn.commit()
-    conn.close()
+    comments_approved(rows)
     return jsonify({"status": "ok"}), 200
 
 
-if __name__ == "__main__":
-    if not os.path.exists(DB_PATH):
-        from db_initiation import init_db
-        init_db()
+@app.post("/api/comments/approve")
+def approve_comments_bulk():
+    """
+    Zatwierdza wiele komentarzy jednym UPDATE.
+    Body: {"ids": [1, 2, 3]} albo {"filter": {"post_id": 1, "author": "...", "created_before": "..."}}
+    """
+    data = request.get_json(force=True) or {}
+    ids = data.get("ids")
+    flt = data.get("filter")
+
+    sql = "UPDATE comments SET approved = 1 WHERE approved = 0"
+    params = []
+
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return jsonify({"error": "ids must be a list of integers"}), 400
+        # cała lista jako jeden parametr - bez limitu liczby zmiennych SQLite
+        sql += " AND id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(ids))
+    elif isinstance(flt, dict) and flt:
+        if "post_id" in flt:
+            sql += " AND post_id = ?"
+            params.append(flt["post_id"])
+        if "author" in flt:
+            sql += " AND author = ?"
+            params.append(flt["author"])
+        if "created_before" in flt:
+            sql += " AND created_at < ?"
+            params.append(flt["created_before"])
+        if not params:
+            return jsonify({"error": "unknown filter, use post_id, author or created_before"}), 400
+    else:
+        return jsonify({"error": "ids or filter is required"}), 400
+
+    conn = get_db_connection()
+    rows = conn.execute(f"{sql} RETURNING {COMMENT_COLUMNS}", params).fetchall()
+    if rows:
+        http_cache.bump_versions(conn, "comments", "posts")
+    conn.commit()
+    comments_approved(rows)
+    return jsonify({"status": "ok", "approved": len(rows)}), 200
+
+
+def comments_approved(rows):
+    """Po zatwierdzeniu: czyści cache odpowiedzi (liczniki w postach też się zmieniły) i wysyła zdarzenia."""
+    if rows:
+        payload_cache.invalidate("posts")
+    for post_id in {row["post_id"] for row in rows}:
+        payload_cache.invalidate("post", post_id)
+        payload_cache.invalidate("comments", post_id)
+    for row in rows:
+        comment_events.publish("comment-approved", dict(row))
+
 
+@app.get("/api/cache/stats")
+def cache_stats():
+    return jsonify(payload_cache.stats())
+
+
+@app.get("/api/comments/queue/stats")
+def comment_queue_stats():
+    if comment_writer is None:
+        return jsonify({"mode": COMMENT_WRITE_MODE})
+    return jsonify({"mode": COMMENT_WRITE_MODE, **comment_writer.stats()})
+
+
+@app.get("/api/comments/stream")
+def comments_stream():
+    """
+    Server-Sent Events: comment-created (nowy komentarz do moderacji) i comment-approved.
+    ?post_id= -> tylko zdarzenia jednego posta
+    ?events=comment-approved -> tylko wybrane rodzaje zdarzeń (lista po przecinku)
+    ?since_id= (albo nagłówek Last-Event-ID wysyłany przez EventSource) -> wznowienie od danego zdarzenia;
+    zdarzenie reset oznacza, że części zdarzeń nie da się odtworzyć i listy trzeba pobrać od nowa.
+    """
+    since_id = request.args.get("since_id", type=int)
+    if since_id is None:
+        since_id = request.headers.get("Last-Event-ID", type=int)
+    post_id = request.args.get("post_id", type=int)
+    # strona posta nie powinna dostawać comment-created z treścią komentarzy czekających na moderację
+    events = {name.strip() for name in request.args.get("events", "").split(",") if name.strip()} or None
+    sub, replay = comment_events.subscribe(since_id, post_id, events)
+
+    def stream():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            for event in replay:
+                yield format_event(event)
+            while not sub.overflowed:
+                try:
+                    event = sub.queue.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event)
+            # klient nie nadążał - po zamknięciu połączy się ponownie i dostanie brakujące zdarzenia z historii
+        finally:
+            comment_events.unsubscribe(sub)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,131 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+import db_connection
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+# jak długo wątek zapisujący czeka na kolejne komentarze, zanim zapisze niepełną paczkę
+FLUSH_INTERVAL = 0.05
+RETRY_DELAY = 0.5
+
+
+class CommentWriter:
+    """
+    Zapis komentarzy w tle (write-behind): submit() tylko wkłada komentarz do ograniczonej kolejki,
+    a jeden wątek zapisuje je paczkami - wiele INSERT-ów w jednej transakcji zamiast commita na żądanie.
+    Gdy kolejka jest pełna, submit() rzuca queue.Full, a żądanie powinno zostać odrzucone.
+    Paczka, której nie da się zapisać z innego powodu niż blokada bazy, jest odrzucana (licznik dropped),
+    a wątek pracuje dalej - inaczej kolejka by się zapełniła i każde kolejne żądanie dostawałoby 503.
+    on_flush(comments) jest wywoływane po zapisie każdej paczki, już z prawdziwymi id.
+    """
+
+    def __init__(self, db_path, on_flush=None, maxsize=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        self.db_path = db_path
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize)
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.last_error = None
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="comment-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, post_id, author, body, created_at):
+        """Zwraca tymczasowe id komentarza; prawdziwe pojawi się w zdarzeniu comment-created."""
+        comment = {"provisional_id": uuid.uuid4().hex, "post_id": post_id,
+                   "author": author, "body": body, "created_at": created_at}
+        try:
+            self.queue.put_nowait(comment)
+        except queue.Full:
+            self.rejected += 1
+            raise
+        return comment["provisional_id"]
+
+    def close(self):
+        """Zapisuje wszystko, co zostało w kolejce, i kończy wątek."""
+        self._stopping.set()
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+            "alive": self._thread.is_alive()
+        }
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=FLUSH_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = db_connection.connect(self.db_path)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch:
+                    try:
+                        self._write(conn, batch)
+                    except Exception as e:
+                        # np. IntegrityError albo błąd w kodzie - ponawianie nic nie da
+                        log.exception("Odrzucono paczkę %d komentarzy", len(batch))
+                        self.dropped += len(batch)
+                        self.last_error = repr(e)
+                elif self._stopping.is_set():
+                    return
+        finally:
+            conn.close()
+
+    def _write(self, conn, batch):
+        # paczka jest ponawiana aż do skutku (np. przy "database is locked"), kolejka w tym czasie się zapełnia
+        while True:
+            try:
+                with conn:
+                    for comment in batch:
+                        cur = conn.execute("""
+                            INSERT INTO comments (post_id, author, body, created_at, approved)
+                            VALUES (?, ?, ?, ?, 0)
+                        """, (comment["post_id"], comment["author"], comment["body"], comment["created_at"]))
+                        comment["id"] = cur.lastrowid
+                        comment["approved"] = 0
+                    titles = dict(conn.execute(
+                        "SELECT id, title FROM posts WHERE id IN (SELECT value FROM json_each(?))",
+                        (json.dumps(list({c["post_id"] for c in batch})),)
+                    ).fetchall())
+                break
+            except sqlite3.OperationalError:
+                log.exception("Nie udało się zapisać %d komentarzy, ponawiam", len(batch))
+                time.sleep(RETRY_DELAY)
+
+        self.written += len(batch)
+        self.batches += 1
+        if self.on_flush:
+            for comment in batch:
+                comment["post_title"] = titles.get(comment["post_id"])
+            try:
+                self.on_flush(batch)
+            except Exception:
+                log.exception("Błąd w on_flush")
@@ -0,0 +1,9 @@
+# Lab02-Lab04 share one implementation: ../shared/db_connection.py
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from shared.db_connection import *  # noqa: E402,F401,F403
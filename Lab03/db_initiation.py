@@ -1,8 +1,34 @@
 import sqlite3
 from datetime import datetime
 
+from http_cache import create_version_table
+
 DB_PATH = "blog.db"
 
+# wszystkie daty trzymamy jako ISO 8601 (UTC) z mikrosekundami, więc sortowanie tekstowe = chronologiczne
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+ISO_TIMESTAMP_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T[0-9][0-9]:[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9][0-9][0-9][0-9]"
+LEGACY_TIMESTAMP_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y, %H:%M:%S",
+)
+
+
+def now_timestamp():
+    return datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+
+
+def normalize_timestamp(value):
+    for fmt in LEGACY_TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"Nieznany format daty: {value!r}")
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
@@ -15,7 +41,9 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
             body TEXT NOT NULL,
-            created_at TEXT NOT NULL
+            created_at TEXT NOT NULL,
+            approved_comment_count INTEGER NOT NULL DEFAULT 0,
+            last_comment_at TEXT
         );
     """)
 
@@ -30,8 +58,11 @@ def init_db():
             FOREIGN KEY (post_id) REFERENCES posts(id)
         );
     """)
+    conn.commit()
+    # triggery i indeksy muszą istnieć przed wstawieniem danych przykładowych
+    migrate_db()
 
-    now = datetime.utcnow().isoformat()
+    now = now_timestamp()
 
     c.execute("INSERT INTO posts (title, body, created_at) VALUES (?, ?, ?)",
               ("Dlaczego mój kod działa? (A dlaczego nie działa wtedy, kiedy musi?)", 
@@ -47,7 +78,7 @@ def init_db():
                 "„O, znalazłam literówkę w zmiennej.”\n"
                 "Morał?\n"
                 "Jeśli Twój kod działa od razu — nie ciesz się za wcześnie.\n"
-                "To tylko chwilowe zawieszenie broni.", '25.11.2025 13:09:22'))
+                "To tylko chwilowe zawieszenie broni.", '2025-11-25T13:09:22.000000'))
 
     c.execute("INSERT INTO posts (title, body, created_at) VALUES (?, ?, ?)",
               ("Co bym powiedziała sobie 5 lat temu?", 
@@ -59,7 +90,7 @@ def init_db():
         INSERT INTO comments (post_id, author, body, created_at, approved)
         VALUES (?, ?, ?, ?, ?)
     """, [
-        (1, "Ola", "Super wpis!", '25.11.2025, 18:12:45', 1),
+        (1, "Ola", "Super wpis!", '2025-11-25T18:12:45.000000', 1),
         (1, "Anonim", "Czekam na więcej!", now, 0),
         (2, "Kasia", "Fajne!", now, 1),
     ])
@@ -68,5 +99,91 @@ def init_db():
     conn.close()
     print("Baza blog.db została zainicjalizowana.")
 
+
+def migrate_db():
+    """Dostosowuje istniejącą bazę do bieżącego schematu; można uruchamiać wielokrotnie."""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    for table in ("posts", "comments"):
+        rows = c.execute(
+            f"SELECT id, created_at FROM {table} WHERE created_at NOT GLOB ?", (ISO_TIMESTAMP_GLOB,)
+        ).fetchall()
+        c.executemany(f"UPDATE {table} SET created_at = ? WHERE id = ?",
+                      [(normalize_timestamp(created_at), row_id) for row_id, created_at in rows])
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_created_at_id ON posts(created_at, id);")
+    # częściowe indeksy: kolejka moderacji i zatwierdzone komentarze posta
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_comments_pending
+        ON comments(created_at) WHERE approved = 0;
+    """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_comments_approved_post
+        ON comments(post_id, created_at) WHERE approved = 1;
+    """)
+
+    # zdenormalizowane dane o zatwierdzonych komentarzach, żeby lista postów nie odpytywała komentarzy
+    columns = {row[1] for row in c.execute("PRAGMA table_info(posts)")}
+    if "approved_comment_count" not in columns:
+        c.execute("ALTER TABLE posts ADD COLUMN approved_comment_count INTEGER NOT NULL DEFAULT 0")
+        c.execute("ALTER TABLE posts ADD COLUMN last_comment_at TEXT")
+        c.execute("""
+            UPDATE posts SET
+                approved_comment_count = (SELECT COUNT(*) FROM comments
+                                          WHERE post_id = posts.id AND approved = 1),
+                last_comment_at = (SELECT MAX(created_at) FROM comments
+                                   WHERE post_id = posts.id AND approved = 1)
+        """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS comments_approved_insert
+        AFTER INSERT ON comments WHEN new.approved = 1
+        BEGIN
+            UPDATE posts SET
+                approved_comment_count = approved_comment_count + 1,
+                last_comment_at = MAX(IFNULL(last_comment_at, new.created_at), new.created_at)
+            WHERE id = new.post_id;
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS comments_approved_update
+        AFTER UPDATE OF approved ON comments WHEN old.approved = 0 AND new.approved = 1
+        BEGIN
+            UPDATE posts SET
+                approved_comment_count = approved_comment_count + 1,
+                last_comment_at = MAX(IFNULL(last_comment_at, new.created_at), new.created_at)
+            WHERE id = new.post_id;
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS comments_unapproved_update
+        AFTER UPDATE OF approved ON comments WHEN old.approved = 1 AND new.approved = 0
+        BEGIN
+            UPDATE posts SET
+                approved_comment_count = approved_comment_count - 1,
+                last_comment_at = (SELECT MAX(created_at) FROM comments
+                                   WHERE post_id = old.post_id AND approved = 1)
+            WHERE id = old.post_id;
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS comments_approved_delete
+        AFTER DELETE ON comments WHEN old.approved = 1
+        BEGIN
+            UPDATE posts SET
+                approved_comment_count = approved_comment_count - 1,
+                last_comment_at = (SELECT MAX(created_at) FROM comments
+                                   WHERE post_id = old.post_id AND approved = 1)
+            WHERE id = old.post_id;
+        END;
+    """)
+
+    # wersje tabel - walidatory ETag/Last-Modified dla zapytań warunkowych
+    create_version_table(c, ("posts", "comments"))
+
+    conn.commit()
+    conn.close()
+
 if __name__ == "__main__":
     init_db()
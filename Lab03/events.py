@@ -0,0 +1,78 @@
+import json
+import queue
+import threading
+from collections import deque
+
+# ile ostatnich zdarzeń pamiętamy do wznowienia strumienia (?since_id= / Last-Event-ID)
+HISTORY_SIZE = 1000
+# zdarzenia czekające na wysłanie do jednego klienta; po przepełnieniu strumień jest zamykany,
+# a przeglądarka łączy się ponownie z Last-Event-ID
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscriber:
+    def __init__(self, post_id=None, events=None):
+        self.post_id = post_id
+        self.events = events
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event):
+        if self.events is not None and event["event"] not in self.events:
+            return False
+        return self.post_id is None or event["data"].get("post_id") == self.post_id
+
+
+class EventBroker:
+    """
+    Pub/sub w obrębie procesu: każdy subskrybent ma własną, ograniczoną kolejkę,
+    więc wolny klient nie blokuje publikujących ani pozostałych klientów.
+    Numery zdarzeń rosną od 1 i zaczynają się od nowa po restarcie procesu.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._last_id = 0
+
+    def publish(self, name, data):
+        with self._lock:
+            self._last_id += 1
+            event = {"id": self._last_id, "event": name, "data": data}
+            self._history.append(event)
+            for sub in list(self._subscribers):
+                if not sub.wants(event):
+                    continue
+                try:
+                    sub.queue.put_nowait(event)
+                except queue.Full:
+                    sub.overflowed = True
+                    self._subscribers.discard(sub)
+
+    def subscribe(self, since_id=None, post_id=None, events=None):
+        """
+        Zwraca (subskrybent, zdarzenia do powtórzenia).
+        events - zbiór nazw zdarzeń do przekazywania (None = wszystkie); reset jest wysyłany zawsze.
+        Gdy since_id jest spoza historii, zamiast nich zwraca jedno zdarzenie "reset" -
+        klient musi wtedy pobrać listy od nowa.
+        """
+        sub = Subscriber(post_id, events)
+        with self._lock:
+            replay = []
+            if since_id is not None:
+                oldest = self._history[0]["id"] if self._history else self._last_id + 1
+                if since_id > self._last_id or since_id < oldest - 1:
+                    replay = [{"id": self._last_id, "event": "reset", "data": {}}]
+                else:
+                    replay = [e for e in self._history if e["id"] > since_id and sub.wants(e)]
+            self._subscribers.add(sub)
+        return sub, replay
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
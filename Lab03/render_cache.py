@@ -0,0 +1,109 @@
+import gzip
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+try:
+    import brotli
+except ImportError:   # brotli jest opcjonalny, bez niego zostaje gzip
+    brotli = None
+
+# krótszych odpowiedzi nie opłaca się kompresować
+MIN_COMPRESS_SIZE = 512
+# nagłówki odpowiedzi, które trzeba zapamiętać razem z treścią (np. kursor stronicowania)
+KEPT_HEADERS = ("X-Next-After",)
+
+
+class Payload:
+    """Gotowa odpowiedź: treść JSON i jej skompresowane wersje, zbudowane raz przy zapisie do cache."""
+
+    def __init__(self, etag, body, mimetype, headers):
+        self.etag = etag
+        self.mimetype = mimetype
+        self.headers = headers
+        self.encoded = {"identity": body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.encoded["gzip"] = gzip.compress(body, compresslevel=9)
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(body)
+
+    def response(self):
+        encoding = request.accept_encodings.best_match(list(self.encoded), default="identity")
+        res = Response(self.encoded[encoding], mimetype=self.mimetype, headers=self.headers)
+        if encoding != "identity":
+            res.headers["Content-Encoding"] = encoding
+        res.vary.add("Accept-Encoding")
+        return res
+
+
+class PayloadCache:
+    """
+    LRU gotowych odpowiedzi. Klucz to (zakres, post_id, query string), np. ("post", 1, "").
+    Wpis jest ważny tylko dla ETagu, z którym go zbudowano (wersje tabel z http_cache),
+    więc zapis w innym procesie też go unieważnia; invalidate() zwalnia pamięć od razu.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            payload = self._data.get(key)
+            if payload is None or payload.etag != etag:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return payload
+
+    def put(self, key, payload):
+        with self._lock:
+            self._data[key] = payload
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, scope, post_id=None):
+        with self._lock:
+            for key in [k for k in self._data if k[0] == scope and k[1] == post_id]:
+                del self._data[key]
+
+    def cached(self, scope):
+        """
+        Dekorator widoku GET; musi być pod http_cache.conditional, który wylicza ETag (g.etag).
+        Odpowiedzi inne niż 200 nie są zapamiętywane.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (scope, kwargs.get("post_id"), request.query_string)
+                etag = g.get("etag")
+                payload = self.get(key, etag)
+                if payload is None:
+                    res = make_response(view(*args, **kwargs))
+                    if res.status_code != 200:
+                        return res
+                    headers = {h: res.headers[h] for h in KEPT_HEADERS if h in res.headers}
+                    payload = Payload(etag, res.get_data(), res.mimetype, headers)
+                    self.put(key, payload)
+                return payload.response()
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0,
+                "brotli": brotli is not None
+            }
@@ -1,104 +1,116 @@
-from flask import Flask, jsonify, request, make_response
-import sqlite3
-from db_initiation import DB_PATH, init_db
+import atexit
+import io
+import os
+
+import click
+from flask import Flask, g, jsonify, request, make_response
+import db_connection
+import http_cache
+from db_initiation import (DB_PATH, ADD_MOVIE_RATINGS, add_rating_totals, init_db,
+                           rebuild_rating_stats, rebuild_rating_totals)
+from leaderboard import Leaderboard
+from rating_buffer import BufferFull, RatingBuffer
+from rating_import import BATCH_SIZE, import_ratings, validate_rating
 
 app = Flask(__name__, static_folder="static", static_url_path="")
+db_connection.init_app(app)
+http_cache.init_app(app)
 
 init_db()
 
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# tables whose versions validate the listings and the in-memory leaderboard
+RANKING_TABLES = ("movies", "ratings")
+RANKED_MOVIE_COLUMNS = "id, title, year, avg_score, rating_count AS votes"
+# ?rank= -> ranking key; each ORDER BY matches a (year, key DESC, rating_count DESC, title) index
+RANK_ORDER = {
+    "average": "m.avg_score DESC, m.rating_count DESC, m.title ASC",
+    "bayesian": "m.bayes_score DESC, m.rating_count DESC, m.title ASC",
+}
 
-@app.route("/")
-def index():
-
-    return app.send_static_file("index.html")
 
+def get_connection():
+    return db_connection.get_request_connection(DB_PATH)
 
-@app.route("/api/movies", methods=["GET"])
-def get_movies():
-    year = request.args.get("year", type=int)
-    limit = request.args.get("limit", type=int)
-
-    conn = get_connection()
-    cur = conn.cursor()
 
-    query = """
-        SELECT
-            m.id,
-            m.title,
-            m.year,
-            IFNULL(ROUND(AVG(r.score), 2), 0) AS avg_score,
-            COUNT(r.id) AS votes
-        FROM movies m
-        LEFT JOIN ratings r ON r.movie_id = m.id
+def query_ranked_movies(conn, year=None, limit=None, rank="average"):
     """
+    Movies from best to worst. The ORDER BY matches idx_movies_rank / idx_movies_year_rank
+    (or their bayes_score counterparts), so this is an index range scan that stops after `limit` rows
+    instead of a sort.
+    """
+    columns = RANKED_MOVIE_COLUMNS
+    if rank == "bayesian":
+        columns += ", ROUND(bayes_score, 2) AS bayes_score"
+    query = f"SELECT {columns} FROM movies m"
     params = []
 
     if year:
         query += " WHERE m.year = ?"
         params.append(year)
 
-    query += """
-        GROUP BY m.id
-        ORDER BY avg_score DESC, votes DESC, m.title ASC
-    """
+    query += f" ORDER BY {RANK_ORDER[rank]}"
 
     if limit:
         query += " LIMIT ?"
         params.append(limit)
 
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
+    return [dict(row) for row in conn.execute(query, params)]
 
-    movies = [dict(row) for row in rows]
-    return jsonify(movies)
 
+leaderboard = Leaderboard(lambda year, k: query_ranked_movies(get_connection(), year, k))
 
-@app.route("/api/movies/top", methods=["GET"])
-def get_top_movies():
-    # bonus: GET /api/movies/top?limit=5&year=2014
-    year = request.args.get("year", type=int)
-    limit = request.args.get("limit", default=5, type=int)
+# "sync" - every rating is committed in its request (201), "buffer" - ratings are written in batches (202)
+RATING_WRITE_MODE = os.environ.get("RATING_WRITE_MODE", "sync")
+rating_buffer = None
+if RATING_WRITE_MODE == "buffer":
+    rating_buffer = RatingBuffer(DB_PATH)
+    # ratings still in memory are written before the process exits
+    atexit.register(rating_buffer.close)
 
-    conn = get_connection()
-    cur = conn.cursor()
+@app.route("/")
+def index():
 
-    query = """
-        SELECT
-            m.id,
-            m.title,
-            m.year,
-            IFNULL(ROUND(AVG(r.score), 2), 0) AS avg_score,
-            COUNT(r.id) AS votes
-        FROM movies m
-        LEFT JOIN ratings r ON r.movie_id = m.id
-    """
-    params = []
+    return app.send_static_file("index.html")
 
-    if year:
-        query += " WHERE m.year = ?"
-        params.append(year)
 
-    query += """
-        GROUP BY m.id
-        ORDER BY avg_score DESC, votes DESC, m.title ASC
-        LIMIT ?
-    """
-    params.append(limit)
+@app.route("/api/movies", methods=["GET"])
+@http_cache.conditional(get_connection, *RANKING_TABLES)
+def get_movies():
+    year = request.args.get("year", type=int)
+    limit = request.args.get("limit", type=int)
+    rank = request.args.get("rank", "average")
+    if rank not in RANK_ORDER:
+        return jsonify({"error": "rank must be average or bayesian"}), 400
+
+    movies = query_ranked_movies(get_connection(), year, limit, rank)
+    return jsonify(movies)
 
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
 
-    movies = [dict(row) for row in rows]
+@app.route("/api/movies/top", methods=["GET"])
+@http_cache.conditional(get_connection, *RANKING_TABLES)
+def get_top_movies():
+    # bonus: GET /api/movies/top?limit=5&year=2014
+    year = request.args.get("year", type=int)
+    # the top list always has a limit; query_ranked_movies would treat 0 as "no limit"
+    limit = max(1, request.args.get("limit", default=5, type=int))
+    rank = request.args.get("rank", "average")
+    if rank not in RANK_ORDER:
+        return jsonify({"error": "rank must be average or bayesian"}), 400
+
+    # the average ranking is answered from memory; other rankings and limits above the board size
+    # fall back to the index scan
+    movies = leaderboard.top(year or None, limit, g.etag) if rank == "average" else None
+    if movies is None:
+        movies = query_ranked_movies(get_connection(), year, limit, rank)
     return jsonify(movies)
 
 
+@app.route("/api/movies/leaderboard/stats", methods=["GET"])
+def leaderboard_stats():
+    return jsonify(leaderboard.stats())
+
+
 @app.route("/api/movies", methods=["POST"])
 def create_movie():
     if not request.is_json:
@@ -123,8 +135,8 @@ def create_movie():
         (title, year),
     )
     movie_id = cur.lastrowid
+    http_cache.bump_versions(conn, "movies")
     conn.commit()
-    conn.close()
 
     resp = make_response({"id": movie_id, "title": title, "year": year}, 201)
     resp.headers["Location"] = f"/api/movies/{movie_id}"
@@ -137,46 +149,113 @@ def create_rating():
         return jsonify({"error": "Expected application/json"}), 400
 
     data = request.get_json() or {}
-    movie_id = data.get("movie_id")
-    score = data.get("score")
-
-    try:
-        movie_id = int(movie_id)
-    except (TypeError, ValueError):
-        return jsonify({"error": "movie_id must be integer"}), 422
-
-    try:
-        score = int(score)
-    except (TypeError, ValueError):
-        return jsonify({"error": "score must be integer"}), 422
-
-    if not (1 <= score <= 5):
-        return jsonify({"error": "score must be between 1 and 5"}), 422
+    if not isinstance(data, dict):
+        return jsonify({"error": "expected an object"}), 422
+    rating, error = validate_rating(data)
+    if error:
+        return jsonify({"error": error}), 422
+    movie_id, score = rating
 
     conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("SELECT id FROM movies WHERE id = ?", (movie_id,))
-    if cur.fetchone() is None:
-        conn.close()
+    if rating_buffer is not None:
+        # a read, so it does not wait for the write lock
+        if conn.execute("SELECT 1 FROM movies WHERE id = ?", (movie_id,)).fetchone() is None:
+            return jsonify({"error": "movie not found"}), 404
+        try:
+            rating_buffer.add(movie_id, score)
+        except BufferFull:
+            resp = make_response({"error": "too many ratings, try again later"}, 503)
+            resp.headers["Retry-After"] = "1"
+            return resp
+        return make_response({"status": "queued"}, 202)
+
+    # the aggregate update doubles as the existence check; both writes commit together
+    cur.execute(
+        f"{ADD_MOVIE_RATINGS} RETURNING {RANKED_MOVIE_COLUMNS}",
+        {"sum": score, "count": 1, "movie_id": movie_id},
+    )
+    movie = cur.fetchone()
+    if movie is None:
+        conn.rollback()
         return jsonify({"error": "movie not found"}), 404
+    if add_rating_totals(conn, score, 1):
+        # the prior moved, so every bayes_score was rewritten
+        http_cache.bump_versions(conn, "movies")
 
+    # the UPDATE holds the write lock, so nobody else can bump the versions between these reads
+    etag_before = http_cache.get_validators(conn, RANKING_TABLES)[0]
     cur.execute(
         "INSERT INTO ratings (movie_id, score) VALUES (?, ?)",
         (movie_id, score),
     )
     rating_id = cur.lastrowid
+    http_cache.bump_versions(conn, "ratings")
+    etag_after = http_cache.get_validators(conn, RANKING_TABLES)[0]
     conn.commit()
-    conn.close()
+    leaderboard.rated(dict(movie), etag_before, etag_after)
 
     resp = make_response({"id": rating_id}, 201)
     resp.headers["Location"] = f"/api/ratings/{rating_id}"
     return resp
 
+
+@app.route("/api/ratings/bulk", methods=["POST"])
+def create_ratings_bulk():
+    """
+    Body: NDJSON (Content-Type: application/x-ndjson), one {"movie_id": 1, "score": 5} per line.
+    The body is streamed and written in batches, each in its own transaction; invalid lines are skipped
+    and reported. Returns inserted/rejected counts, the first errors and rows/sec.
+    """
+    if request.mimetype != "application/x-ndjson":
+        return jsonify({"error": "Expected application/x-ndjson"}), 400
+
+    lines = io.BufferedReader(request.stream, 1 << 16)
+    report = import_ratings(get_connection(), lines)
+    return jsonify(report), 200
+
+
+@app.route("/api/ratings/buffer/stats", methods=["GET"])
+def rating_buffer_stats():
+    if rating_buffer is None:
+        return jsonify({"mode": RATING_WRITE_MODE})
+    return jsonify({"mode": RATING_WRITE_MODE, **rating_buffer.stats()})
+
+
+@app.cli.command("import-ratings")
+@click.argument("path", type=click.File("rb"))
+@click.option("--batch-size", default=BATCH_SIZE, show_default=True, help="Ratings written per transaction.")
+def import_ratings_command(path, batch_size):
+    """Loads ratings from an NDJSON file (or - for stdin) without going through the HTTP API."""
+    def progress(report):
+        print(f"{report['inserted']} rows, {report['rows_per_second']} rows/s")
+
+    report = import_ratings(get_connection(), path, batch_size, on_batch=progress)
+    for error in report["errors"]:
+        print(f"line {error['index'] + 1}: {error['error']}")
+    print(f"Inserted {report['inserted']}, rejected {report['rejected']} in {report['seconds']} s "
+          f"({report['rows_per_second']} rows/s)")
+
+
+@app.cli.command("rebuild-ratings")
+def rebuild_ratings():
+    """Recomputes rating_sum / rating_count of all movies and the global totals from the ratings table."""
+    conn = get_connection()
+    drift = rebuild_rating_stats(conn)
+    rebuild_rating_totals(conn)
+    http_cache.bump_versions(conn, "movies", "ratings")
+    conn.commit()
+    for movie_id, stored, actual in drift:
+        print(f"movie {movie_id}: stored {stored} ratings, actual {actual}")
+    print(f"Drifted movies: {len(drift)}")
+
+
 @app.after_request
 def add_security_headers(response):
     response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["Cache-Control"] = "no-store"
+    # read endpoints and static files set their own caching headers
+    response.headers.setdefault("Cache-Control", "no-store")
     return response
 
 
@@ -0,0 +1,116 @@
+"""Benchmarks for the movies API, run against a scratch database in a temporary directory.
+
+movies.db is not touched.
+
+    # GET /api/movies/top: GROUP BY over ratings vs indexed ranking key vs in-memory leaderboard
+    python benchmark.py top --movies 5000 --ratings 1000000 --repeat 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the listing query before the aggregates on movies existed
+GROUP_BY_QUERY = """
+    SELECT m.id, m.title, m.year,
+           IFNULL(ROUND(AVG(r.score), 2), 0) AS avg_score,
+           COUNT(r.id) AS votes
+    FROM movies m
+    LEFT JOIN ratings r ON r.movie_id = m.id
+    {where}
+    GROUP BY m.id
+    ORDER BY avg_score DESC, votes DESC, m.title ASC
+    LIMIT ?
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    top = commands.add_parser("top", help="top-N strategies")
+    top.add_argument("--movies", type=int, default=5000)
+    top.add_argument("--ratings", type=int, default=1000000)
+    top.add_argument("--years", type=int, default=30)
+    top.add_argument("--limit", type=int, default=10)
+    top.add_argument("--repeat", type=int, default=200)
+
+    return parser.parse_args()
+
+
+def load_movies_app():
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, HERE)
+    import app as movies
+    return movies
+
+
+def fill(movies, args):
+    rng = random.Random(0)
+    with movies.app.app_context():
+        conn = movies.get_connection()
+        conn.executemany(
+            "INSERT INTO movies (title, year) VALUES (?, ?)",
+            [(f"Movie {i}", 2000 + i % args.years) for i in range(args.movies)]
+        )
+        ids = [row[0] for row in conn.execute("SELECT id FROM movies")]
+        conn.executemany(
+            "INSERT INTO ratings (movie_id, score) VALUES (?, ?)",
+            ((rng.choice(ids), rng.randint(1, 5)) for _ in range(args.ratings))
+        )
+        movies.rebuild_rating_stats(conn)
+        movies.rebuild_rating_totals(conn)
+        movies.http_cache.bump_versions(conn, *movies.RANKING_TABLES)
+        conn.commit()
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[-1]
+
+
+def bench_top(movies, args):
+    print(f"filling {args.movies} movies and {args.ratings} ratings...")
+    fill(movies, args)
+
+    with movies.app.app_context():
+        conn = movies.get_connection()
+        etag = movies.http_cache.get_validators(conn, movies.RANKING_TABLES)[0]
+        year = 2000
+
+        strategies = {
+            "group-by": lambda y: conn.execute(
+                GROUP_BY_QUERY.format(where="WHERE m.year = ?" if y else ""),
+                ([y] if y else []) + [args.limit]
+            ).fetchall(),
+            "index": lambda y: movies.query_ranked_movies(conn, y, args.limit),
+            "memory": lambda y: movies.leaderboard.top(y, args.limit, etag),
+        }
+
+        print(f"{'strategy':<10} {'scope':<10} {'median us':>12} {'max us':>12}")
+        for name, fn in strategies.items():
+            # the GROUP BY scans every rating, so fewer runs are enough
+            repeat = max(3, args.repeat // 20) if name == "group-by" else args.repeat
+            for scope, y in (("all", None), ("year", year)):
+                fn(y)   # warm-up; loads the leaderboard board
+                median, worst = measure(lambda: fn(y), repeat)
+                print(f"{name:<10} {scope:<10} {median * 1e6:>12.1f} {worst * 1e6:>12.1f}")
+
+
+def main():
+    args = parse_args()
+    movies = load_movies_app()
+    bench_top(movies, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,33 @@
 import os
 import sqlite3
 
+from http_cache import create_version_table
+
 DB_PATH = "movies.db"
 
+# ranking key of the listings; 0 for movies without ratings
+AVG_SCORE = """
+    CASE WHEN rating_count > 0
+         THEN ROUND(CAST(rating_sum AS REAL) / rating_count, 2)
+         ELSE 0 END
+"""
+
+# Bayesian ranking: (rating_sum + MIN_VOTES * mean) / (rating_count + MIN_VOTES), where mean is the
+# prior_mean stored in rating_totals. Movies with few votes are pulled towards the global mean.
+MIN_VOTES = 10
+# stored scores use the prior from their last refresh; all are recomputed once the real mean moves further
+PRIOR_TOLERANCE = 0.01
+
+# adds :count ratings with scores summing to :sum to one movie, keeping bayes_score in step
+ADD_MOVIE_RATINGS = """
+    UPDATE movies SET
+        rating_sum = rating_sum + :sum,
+        rating_count = rating_count + :count,
+        bayes_score = (rating_sum + :sum + (SELECT min_votes * prior_mean FROM rating_totals))
+                      / (rating_count + :count + (SELECT min_votes FROM rating_totals))
+    WHERE id = :movie_id
+"""
+
 
 def get_connection():
     conn = sqlite3.connect(DB_PATH)
@@ -13,16 +38,21 @@ def get_connection():
 def init_db():
 
     if os.path.exists(DB_PATH):
+        migrate_db()
         return
 
     conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("""
+    cur.execute(f"""
         CREATE TABLE movies (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
-            year INTEGER NOT NULL
+            year INTEGER NOT NULL,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            avg_score REAL GENERATED ALWAYS AS ({AVG_SCORE}) VIRTUAL,
+            bayes_score REAL NOT NULL DEFAULT 0
         );
     """)
 
@@ -54,9 +84,133 @@ def init_db():
             (4, 4), (4, 4), (4, 5),
         ],
     )
+    rebuild_rating_stats(conn)
 
     conn.commit()
     conn.close()
+    migrate_db()
+
+
+def migrate_db():
+    """Brings an existing database up to the current schema; safe to run repeatedly."""
+    conn = get_connection()
+    cur = conn.cursor()
+
+    # validators for conditional GETs of the movie listings
+    create_version_table(cur, ("movies", "ratings"))
+
+    # per-movie aggregates kept up to date by every rating write, so listings do not scan ratings
+    columns = {row["name"] for row in cur.execute("PRAGMA table_info(movies)")}
+    if "rating_count" not in columns:
+        cur.execute("ALTER TABLE movies ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0")
+        cur.execute("ALTER TABLE movies ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0")
+        rebuild_rating_stats(conn)
+
+    # table_xinfo also lists generated columns, table_info does not
+    columns = {row["name"] for row in cur.execute("PRAGMA table_xinfo(movies)")}
+    if "avg_score" not in columns:
+        cur.execute(f"ALTER TABLE movies ADD COLUMN avg_score REAL GENERATED ALWAYS AS ({AVG_SCORE}) VIRTUAL")
+
+    # the index stores the computed key, so the top lists are range scans in listing order
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_movies_rank
+        ON movies(avg_score DESC, rating_count DESC, title)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_movies_year_rank
+        ON movies(year, avg_score DESC, rating_count DESC, title)
+    """)
+
+    if "bayes_score" not in columns:
+        cur.execute("ALTER TABLE movies ADD COLUMN bayes_score REAL NOT NULL DEFAULT 0")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rating_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            rating_sum INTEGER NOT NULL,
+            rating_count INTEGER NOT NULL,
+            prior_mean REAL NOT NULL,
+            min_votes INTEGER NOT NULL
+        );
+    """)
+    totals = cur.execute("SELECT min_votes FROM rating_totals").fetchone()
+    if totals is None or totals["min_votes"] != MIN_VOTES:
+        rebuild_rating_totals(conn)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_movies_bayes_rank
+        ON movies(bayes_score DESC, rating_count DESC, title)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_movies_year_bayes_rank
+        ON movies(year, bayes_score DESC, rating_count DESC, title)
+    """)
+
+    conn.commit()
+    conn.close()
+
+
+def rebuild_rating_stats(conn):
+    """
+    Recomputes movies.rating_sum / rating_count from the ratings table.
+    Returns (movie_id, stored count, actual count) for movies whose aggregates had drifted.
+    The caller commits.
+    """
+    # one pass over ratings; there is no index on ratings.movie_id, so correlated subqueries would rescan it per movie
+    actual = """
+        SELECT movie_id, SUM(score) AS total, COUNT(*) AS n FROM ratings GROUP BY movie_id
+    """
+    drift = [
+        (row["id"], row["rating_count"], row["actual_count"])
+        for row in conn.execute(f"""
+            SELECT m.id, m.rating_sum, m.rating_count,
+                   IFNULL(s.total, 0) AS actual_sum, IFNULL(s.n, 0) AS actual_count
+            FROM movies m
+            LEFT JOIN ({actual}) s ON s.movie_id = m.id
+        """)
+        if (row["rating_sum"], row["rating_count"]) != (row["actual_sum"], row["actual_count"])
+    ]
+    conn.execute("UPDATE movies SET rating_sum = 0, rating_count = 0")
+    conn.execute(f"""
+        UPDATE movies SET rating_sum = s.total, rating_count = s.n
+        FROM ({actual}) AS s
+        WHERE s.movie_id = movies.id
+    """)
+    return drift
+
+
+def rebuild_rating_totals(conn):
+    """Recomputes the global totals from the per-movie aggregates and refreshes the prior. The caller commits."""
+    conn.execute("""
+        INSERT OR REPLACE INTO rating_totals (id, rating_sum, rating_count, prior_mean, min_votes)
+        SELECT 1, IFNULL(SUM(rating_sum), 0), IFNULL(SUM(rating_count), 0), 0, ? FROM movies
+    """, (MIN_VOTES,))
+    refresh_prior(conn)
+
+
+def refresh_prior(conn):
+    """Sets the prior to the current global mean and recomputes every bayes_score (one pass over movies)."""
+    conn.execute("""
+        UPDATE rating_totals
+        SET prior_mean = IFNULL(CAST(rating_sum AS REAL) / NULLIF(rating_count, 0), 0)
+    """)
+    conn.execute("""
+        UPDATE movies SET bayes_score = (rating_sum + (SELECT min_votes * prior_mean FROM rating_totals))
+                                        / (rating_count + (SELECT min_votes FROM rating_totals))
+    """)
+
+
+def add_rating_totals(conn, score_sum, count):
+    """
+    Adds ratings to the global totals, in the transaction that added them to movies.
+    Returns True when the mean drifted past PRIOR_TOLERANCE and every bayes_score was recomputed.
+    """
+    totals = conn.execute("""
+        UPDATE rating_totals SET rating_sum = rating_sum + ?, rating_count = rating_count + ?
+        RETURNING rating_sum, rating_count, prior_mean
+    """, (score_sum, count)).fetchone()
+    if abs(totals["rating_sum"] / totals["rating_count"] - totals["prior_mean"]) <= PRIOR_TOLERANCE:
+        return False
+    refresh_prior(conn)
+    return True
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import threading
+from bisect import insort
+
+TOP_K = 100
+
+
+def rank_key(movie):
+    # same order as the SQL listings: avg_score DESC, votes DESC, title ASC
+    return -movie["avg_score"], -movie["votes"], movie["title"]
+
+
+class Leaderboard:
+    """
+    In-memory top-K movies for every year (and for all years under None), loaded lazily with load(year, k).
+
+    Boards are only valid for the ETag they were loaded under (the table versions from http_cache),
+    so writes from other processes make them reload. A rating written by this process is applied
+    in place by rated(), which also moves the boards to the ETag after that write.
+    Each board is a small list kept sorted by rank_key; K is small, so an insort beats a heap that
+    would need a full scan to move an existing entry anyway.
+    """
+
+    def __init__(self, load, size=TOP_K):
+        self.load = load
+        self.size = size
+        self.etag = None
+        self.hits = 0
+        self.misses = 0
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def top(self, year, limit, etag):
+        """Returns the best `limit` movies, or None when limit is outside 1..K and the caller has to query."""
+        if not 0 < limit <= self.size:
+            return None
+        with self._lock:
+            if etag != self.etag:
+                self._boards.clear()
+                self.etag = etag
+            board = self._boards.get(year)
+            if board is not None:
+                self.hits += 1
+                return board[:limit]
+            self.misses += 1
+
+        board = sorted(self.load(year, self.size), key=rank_key)
+        with self._lock:
+            if self.etag == etag:
+                self._boards[year] = board
+        return board[:limit]
+
+    def rated(self, movie, etag_before, etag_after):
+        """
+        Applies the new aggregates of one movie (a dict like a listing row) written by this process.
+        etag_before/etag_after are the versions just before and after that write, read in its transaction.
+        """
+        with self._lock:
+            if self.etag != etag_before:
+                # another write came in between: reload instead of guessing the order of updates
+                self._boards.clear()
+                self.etag = None
+                return
+            self.etag = etag_after
+            for year in (None, movie["year"]):
+                board = self._boards.get(year)
+                if board is not None and not self._update(board, movie):
+                    del self._boards[year]
+
+    def _update(self, board, movie):
+        """Moves the movie to its new place; returns False when the board cannot tell who is K-th."""
+        was_full = len(board) >= self.size
+        for i, entry in enumerate(board):
+            if entry["id"] == movie["id"]:
+                del board[i]
+                # it dropped below the last kept entry - a movie outside the board may now be better
+                if was_full and (not board or rank_key(movie) > rank_key(board[-1])):
+                    return False
+                break
+        else:
+            if was_full and rank_key(movie) >= rank_key(board[-1]):
+                return True
+
+        insort(board, movie, key=rank_key)
+        if len(board) > self.size:
+            board.pop()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "boards": len(self._boards), "hits": self.hits, "misses": self.misses}
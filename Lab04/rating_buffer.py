@@ -0,0 +1,139 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import db_connection
+from rating_import import write_batch
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_MS = 100
+FLUSH_SIZE = 1000
+MAX_BUFFERED = 50000
+RETRY_DELAY = 0.5
+# flush durations kept for the latency percentiles
+LATENCY_SAMPLES = 1000
+
+
+class BufferFull(Exception):
+    pass
+
+
+class RatingBuffer:
+    """
+    Buffered rating writes: add() only records the score in memory, grouped by movie, and a background
+    thread writes everything collected every flush_interval_ms (or sooner, once flush_size ratings are
+    waiting) in one transaction - raw rows plus one aggregate delta per movie (rating_import.write_batch).
+    add() raises BufferFull once max_buffered ratings are waiting, so memory stays bounded.
+    A batch that fails for any reason other than a locked database is dropped (and counted), and the thread
+    keeps running - otherwise the buffer would fill up and every later rating would get 503.
+    """
+
+    def __init__(self, db_path, flush_interval_ms=FLUSH_INTERVAL_MS, flush_size=FLUSH_SIZE,
+                 max_buffered=MAX_BUFFERED):
+        self.db_path = db_path
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_size = flush_size
+        self.max_buffered = max_buffered
+        self.flushed = 0
+        self.flushes = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.last_error = None
+        self._scores = {}   # movie_id -> [score, ...]
+        self._count = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="rating-buffer", daemon=True)
+        self._thread.start()
+
+    def add(self, movie_id, score):
+        with self._cond:
+            if self._count >= self.max_buffered:
+                self.rejected += 1
+                raise BufferFull()
+            self._scores.setdefault(movie_id, []).append(score)
+            self._count += 1
+            if self._count >= self.flush_size:
+                self._cond.notify()
+
+    def close(self):
+        """Writes whatever is still buffered and stops the thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            buffered = self._count
+
+        def percentile(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)
+
+        return {
+            "buffered": buffered,
+            "max_buffered": self.max_buffered,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+            "alive": self._thread.is_alive(),
+            "flush_ms": {"p50": percentile(0.5), "p99": percentile(0.99), "max": percentile(1.0)}
+            if latencies else None
+        }
+
+    def _take(self):
+        """Waits for the next flush and swaps the buffer out; returns None when stopping with nothing left."""
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while not self._stopping and self._count < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._count:
+                return None if self._stopping else []
+            scores, self._scores, self._count = self._scores, {}, 0
+        return [(movie_id, score) for movie_id, movie_scores in scores.items() for score in movie_scores]
+
+    def _run(self):
+        conn = db_connection.connect(self.db_path)
+        try:
+            while True:
+                ratings = self._take()
+                if ratings is None:
+                    return
+                if ratings:
+                    try:
+                        self._write(conn, ratings)
+                    except Exception as e:
+                        # e.g. IntegrityError or a bug in write_batch - retrying would not help
+                        conn.rollback()
+                        log.exception("Dropped %d buffered ratings", len(ratings))
+                        with self._cond:
+                            self.dropped += len(ratings)
+                            self.last_error = repr(e)
+        finally:
+            conn.close()
+
+    def _write(self, conn, ratings):
+        start = time.perf_counter()
+        # the batch is retried until it goes through (e.g. "database is locked"); add() keeps the bound meanwhile
+        while True:
+            try:
+                write_batch(conn, ratings)
+                break
+            except sqlite3.OperationalError:
+                conn.rollback()
+                log.exception("Writing %d buffered ratings failed, retrying", len(ratings))
+                time.sleep(RETRY_DELAY)
+        with self._cond:
+            self._latencies.append(time.perf_counter() - start)
+            self.flushed += len(ratings)
+            self.flushes += 1
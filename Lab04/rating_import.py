@@ -0,0 +1,107 @@
+import json
+import time
+
+import http_cache
+from db_initiation import ADD_MOVIE_RATINGS, add_rating_totals
+
+BATCH_SIZE = 50000
+# only the first errors are reported in detail, the rest are counted
+MAX_REPORTED_ERRORS = 100
+
+
+def validate_rating(data):
+    """
+    Checks a rating object; shared by POST /api/ratings and the bulk import, so both accept the same input.
+    movie_id and score are coerced with int(), like the form sends them ("5", 4.0).
+    Returns ((movie_id, score), None) or (None, error message).
+    """
+    try:
+        movie_id = int(data.get("movie_id"))
+    except (TypeError, ValueError, OverflowError):
+        return None, "movie_id must be integer"
+    try:
+        score = int(data.get("score"))
+    except (TypeError, ValueError, OverflowError):
+        return None, "score must be integer"
+    if not (1 <= score <= 5):
+        return None, "score must be between 1 and 5"
+    return (movie_id, score), None
+
+
+def parse_rating(line, movie_ids):
+    """Returns ((movie_id, score), None) for a valid NDJSON line, or (None, error message)."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None, "invalid JSON"
+    if not isinstance(data, dict):
+        return None, "expected an object"
+    rating, error = validate_rating(data)
+    if error:
+        return None, error
+    if rating[0] not in movie_ids:
+        return None, "movie not found"
+    return rating, None
+
+
+def write_batch(conn, ratings):
+    """Inserts one batch and applies its aggregate deltas in a single transaction."""
+    deltas = {}
+    for movie_id, score in ratings:
+        delta = deltas.setdefault(movie_id, [0, 0])
+        delta[0] += score
+        delta[1] += 1
+
+    conn.executemany("INSERT INTO ratings (movie_id, score) VALUES (?, ?)", ratings)
+    conn.executemany(
+        ADD_MOVIE_RATINGS,
+        [{"sum": s, "count": n, "movie_id": movie_id} for movie_id, (s, n) in deltas.items()],
+    )
+    add_rating_totals(conn, sum(s for s, _ in deltas.values()), len(ratings))
+    http_cache.bump_versions(conn, "movies", "ratings")
+    conn.commit()
+
+
+def import_ratings(conn, lines, batch_size=BATCH_SIZE, on_batch=None):
+    """
+    Streams NDJSON lines ({"movie_id": 1, "score": 5}) into ratings, batch_size rows per transaction.
+    Movie ids are checked against a set loaded once at the start, so movies added during the import
+    are rejected. on_batch(report) is called after every committed batch.
+    Returns a report with inserted/rejected counts, the first errors and the rows/sec rate.
+    """
+    movie_ids = {row[0] for row in conn.execute("SELECT id FROM movies")}
+    report = {"inserted": 0, "rejected": 0, "errors": [], "seconds": 0, "rows_per_second": 0}
+    start = time.perf_counter()
+
+    def update_timing():
+        # the rate comes from the raw elapsed time; only the reported values are rounded
+        elapsed = time.perf_counter() - start
+        report["seconds"] = round(elapsed, 3)
+        report["rows_per_second"] = round(report["inserted"] / elapsed) if elapsed else 0
+
+    def flush(batch):
+        write_batch(conn, batch)
+        report["inserted"] += len(batch)
+        update_timing()
+        if on_batch:
+            on_batch(report)
+
+    batch = []
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        rating, error = parse_rating(line, movie_ids)
+        if error:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"index": index, "error": error})
+            continue
+        batch.append(rating)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    update_timing()
+    return report
@@ -0,0 +1,88 @@
+"""Prosty test obciążeniowy dla aplikacji z Lab02-Lab04.
+
+Uruchamia wybrany lab na lokalnym, wielowątkowym serwerze (na kopii bazy w katalogu tymczasowym)
+i przez podany czas wysyła równolegle żądania GET na wskazane adresy, po czym wypisuje liczbę żądań na sekundę.
+
+    python loadtest.py Lab02 /api/products /api/cart --threads 8 --seconds 10
+    python loadtest.py Lab03 /api/posts /api/posts/1/comments
+    python loadtest.py Lab04 /api/movies /api/movies/top
+"""
+import argparse
+import glob
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("lab", help="katalog laboratorium, np. Lab02")
+    parser.add_argument("paths", nargs="+", help="adresy odpytywane po kolei, np. /api/products")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    return parser.parse_args()
+
+
+def load_app(lab):
+    lab_dir = os.path.join(ROOT, lab)
+    work_dir = tempfile.mkdtemp()
+    # kopia baz, żeby test nie zmieniał plików w repozytorium
+    for path in glob.glob(os.path.join(lab_dir, "**", "*.db"), recursive=True):
+        target = os.path.join(work_dir, os.path.relpath(path, lab_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy(path, target)
+    os.chdir(work_dir)
+    sys.path.insert(0, lab_dir)
+
+    import app as module
+    return module.app
+
+
+def worker(base_url, paths, deadline, counts, errors):
+    done = failed = 0
+    i = 0
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + paths[i % len(paths)]) as resp:
+                resp.read()
+            done += 1
+        except Exception:
+            failed += 1
+        i += 1
+    counts.append(done)
+    errors.append(failed)
+
+
+def main():
+    args = parse_args()
+    app = load_app(args.lab)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    counts, errors = [], []
+    deadline = time.perf_counter() + args.seconds
+    with ThreadPoolExecutor(args.threads) as pool:
+        for _ in range(args.threads):
+            pool.submit(worker, base_url, args.paths, deadline, counts, errors)
+    server.shutdown()
+
+    total = sum(counts)
+    print(f"{args.lab}: {total} żądań w {args.seconds:.0f} s -> {total / args.seconds:.1f} req/s "
+          f"({args.threads} wątków, błędy: {sum(errors)})")
+
+
+if __name__ == "__main__":
+    main()
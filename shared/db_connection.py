@@ -0,0 +1,63 @@
+"""Pooled SQLite connections shared by Lab02-Lab04 (each lab imports it through its own db_connection.py)."""
+import queue
+import sqlite3
+
+from flask import g
+
+# applied once when a connection is opened, not per request
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+)
+STATEMENT_CACHE_SIZE = 256
+POOL_SIZE = 16
+
+_pools = {}
+
+
+def connect(db_path):
+    """Opens a configured connection; the caller is responsible for closing it."""
+    conn = sqlite3.connect(db_path, timeout=5, cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _pool(db_path):
+    return _pools.setdefault(str(db_path), queue.LifoQueue(POOL_SIZE))
+
+
+def get_request_connection(db_path):
+    """Returns the connection of the current request, taking it from the pool on first use.
+
+    It goes back to the pool in teardown, so handlers must not call close() on it.
+    """
+    conn = g.get("db_conn")
+    if conn is None:
+        try:
+            conn = _pool(db_path).get_nowait()
+        except queue.Empty:
+            conn = connect(db_path)
+        g.db_conn = conn
+        g.db_path = db_path
+    return conn
+
+
+def release_request_connection(exc=None):
+    conn = g.pop("db_conn", None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool(g.pop("db_path")).put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connection)
@@ -0,0 +1,100 @@
+"""Conditional GET support shared by Lab02-Lab04 (each lab imports it through its own http_cache.py)."""
+import time
+from datetime import datetime, timedelta, UTC
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+# CSS/JS/images; HTML pages are always revalidated so a new deploy is picked up at once
+STATIC_MAX_AGE = 3600
+
+
+def create_version_table(cur, tables):
+    """One row per table; its version is bumped by every write to that table (see bump_versions)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """)
+    cur.executemany(
+        "INSERT OR IGNORE INTO table_versions (name, version, updated_at) VALUES (?, 0, ?)",
+        [(table, time.time()) for table in tables]
+    )
+
+
+def bump_versions(conn, *tables):
+    """Must be called by every path that writes to `tables`, inside the same transaction."""
+    now = time.time()
+    conn.executemany(
+        "UPDATE table_versions SET version = version + 1, updated_at = ? WHERE name = ?",
+        [(now, table) for table in tables]
+    )
+
+
+def get_validators(conn, tables):
+    """Returns (etag, last_modified) for the current versions of `tables`; last_modified is the exact write time."""
+    placeholders = ",".join("?" * len(tables))
+    rows = {r["name"]: r for r in conn.execute(
+        f"SELECT name, version, updated_at FROM table_versions WHERE name IN ({placeholders})",
+        tables
+    )}
+    # updated_at is part of the tag, so a recreated database does not repeat old tags
+    etag = "-".join(f"{rows[t]['version']}.{int(rows[t]['updated_at'])}" for t in tables)
+    last_modified = datetime.fromtimestamp(max(r["updated_at"] for r in rows.values()), UTC)
+    return etag, last_modified
+
+
+def conditional(get_conn, *tables, max_age=0, weak=False):
+    """
+    Answers conditional GETs with 304 Not Modified while none of `tables` changed;
+    the view itself only runs when the client's copy is stale.
+    The validators are read before the view, so a write racing with it only costs an extra 200 later.
+    Views can read the ETag from g.etag. Pass weak=True when the view may send the same data
+    in several encodings (e.g. gzip-compressed or not), since a strong ETag promises identical bytes.
+    max_age=0 lets browsers and proxies store the response but revalidate it on every use.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = get_validators(get_conn(), tables)
+            g.etag = etag
+
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                # If-Modified-Since has whole seconds: a write in the same second as `since` may be newer
+                # than the client's copy, so only writes from an earlier second count as not modified
+                fresh = since is not None and last_modified < since
+
+            if fresh:
+                res = Response(status=304)
+            else:
+                res = make_response(view(*args, **kwargs))
+                if res.status_code != 200:
+                    return res
+
+            res.set_etag(etag, weak=weak)
+            # the end of the second of the last write, so that a client revalidating with it gets a 304;
+            # until that second is over this would be a future time, so the current time is sent instead
+            res.last_modified = min(last_modified.replace(microsecond=0) + timedelta(seconds=1), datetime.now(UTC))
+            res.cache_control.public = True
+            if max_age:
+                res.cache_control.max_age = max_age
+            else:
+                res.cache_control.no_cache = True
+            return res
+        return wrapper
+    return decorator
+
+
+def init_app(app, static_max_age=STATIC_MAX_AGE):
+    """Static files keep Flask's ETag/Last-Modified handling; everything but HTML gets a max-age."""
+    def get_send_file_max_age(filename):
+        if filename and filename.endswith(".html"):
+            return None   # Cache-Control: no-cache
+        return static_max_age
+
+    app.get_send_file_max_age = get_send_file_max_age